@@ -1,37 +1,88 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from transformers import pipeline
+from typing import Optional
 from dotenv import load_dotenv
-import openai
 import os
 import yt_dlp
 import uuid
 import re
+import time
+import threading
+import queue
+import heapq
+import subprocess
+import tempfile
+import io
+import json
+import sqlite3
+import hashlib
+import zlib
+import unicodedata
+from datetime import datetime, timezone
+import asyncio
+import atexit
+from collections import OrderedDict
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from contextlib import contextmanager, asynccontextmanager
 import firebase_admin
 from firebase_admin import credentials, firestore
+from google.api_core.exceptions import FailedPrecondition
 #from textblob import TextBlob
 from collections import Counter
-from transformers import pipeline as transformers_pipeline
 from langdetect import detect
 #from googletrans import Translator
-from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, quote
+from monitoring import metrics
+from classifiers import (
+    model_registry, PRELOAD_MODELS, MODEL_BACKEND, MODEL_SPECS, CACHE_DIR,
+    SENTIMENT_BATCH_SIZE, SENTIMENT_MAX_LENGTH, run_batched_inference,
+    INFERENCE_SERVER_URL, inference_server_status,
+)
 
 
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
 
-# Initialize Firebase
-cred = credentials.Certificate("firebase_credentials.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# OpenAI is imported and configured on first use, it is only needed once a job runs
+openai_client = None
+
+def get_openai():
+    global openai_client
+    if openai_client is None:
+        import openai
+        openai.api_key = os.getenv("OPENAI_API_KEY")
+        openai_client = openai
+    return openai_client
 
 # Initialize the translator
 #translator = Translator()
 
-# Setup EmoRoBERTa
-emo_roberta = pipeline("sentiment-analysis", model="cardiffnlp/twitter-roberta-base-sentiment")
+# ------ METRICS -------
+
+stage_seconds = metrics.histogram(
+    "arcscan_stage_duration_seconds", "Time spent in each analysis stage",
+    [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800],
+)
+audio_seconds = metrics.histogram(
+    "arcscan_audio_duration_seconds", "Length of the transcribed audio",
+    [60, 300, 600, 1200, 1800, 3600, 7200, 10800],
+)
+segment_count = metrics.histogram(
+    "arcscan_transcript_segments", "Whisper segments per transcript",
+    [10, 50, 100, 250, 500, 1000, 2500, 5000, 10000],
+)
+queue_wait_seconds = metrics.histogram(
+    "arcscan_queue_wait_seconds", "Time analysis jobs wait for a free worker",
+    [0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900],
+)
+jobs_finished = metrics.counter("arcscan_jobs_finished_total", "Analysis jobs by final status")
+
+# ------ MODELS -------
+
 label_map = {
     "LABEL_0": "Negative",
     "LABEL_1": "Neutral",
@@ -49,8 +100,31 @@ CORE_EMOTIONS = [
     "relief", "grief", "love", "annoyance"
 ]
 
+# ------ STARTUP -------
+
+# Load PRELOAD_MODELS and connect to storage in the background after startup, so the
+# server accepts connections right away and /ready reports when it can take traffic
+WARM_UP_ON_STARTUP = os.getenv("WARM_UP_ON_STARTUP", "true").lower() == "true"
+startup_state = {"error": None}
+
+def warm_up():
+    try:
+        get_storage()
+        model_registry.warm_up()
+    except Exception as e:
+        startup_state["error"] = str(e)
+        print(f"Warm-up failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app):
+    if WARM_UP_ON_STARTUP:
+        threading.Thread(target=warm_up, daemon=True).start()
+    yield
+    # Shutdown: write out any buffered progress
+    progress_writer.flush()
+
 # Initialize FastAPI
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -65,6 +139,7 @@ class AnalyzeRequest(BaseModel):
     url: str
     user_id: str
     translated: bool = False  # Optional flag to use translated text for analysis
+    advanced: bool = False  # Also run the advanced emotion analysis in the same pass (/analyze only)
 
 # Generate safe document ID based on video URL only
 
@@ -81,16 +156,528 @@ def generate_doc_id(video_url):
     clean_url = clean_video_url(video_url)
     return re.sub(r'\W+', '_', clean_url)
 
+# Extract the 11 character YouTube video id from any URL variant (watch, youtu.be,
+# shorts, embed, live, mirrors using ?v=). Returns None if there is none.
+def extract_video_id(video_url: str):
+    parsed = urlparse(video_url if "//" in video_url else f"https://{video_url}")
+    video_id_pattern = r"[A-Za-z0-9_-]{11}"
+    host = (parsed.hostname or "").lower()
+
+    candidate = parse_qs(parsed.query).get("v", [None])[0]
+    if not candidate and host.endswith("youtu.be"):
+        candidate = parsed.path.strip("/").split("/")[0]
+    if not candidate:
+        match = re.match(r"/(?:shorts|embed|live|v|e)/([^/?#]+)", parsed.path)
+        candidate = match.group(1) if match else None
+    if candidate and re.fullmatch(video_id_pattern, candidate):
+        return candidate
+    return None
+
+# ------ RESULTS CACHE -------
+
+# Seconds a finished analysis stays cached (finished analyses never change)
+RESULTS_CACHE_TTL = float(os.getenv("RESULTS_CACHE_TTL", "3600"))
+# Seconds a missing or unfinished analysis stays cached
+RESULTS_CACHE_NEGATIVE_TTL = float(os.getenv("RESULTS_CACHE_NEGATIVE_TTL", "5"))
+RESULTS_CACHE_SIZE = int(os.getenv("RESULTS_CACHE_SIZE", "256"))
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after their own TTL."""
+
+    def __init__(self, max_entries=RESULTS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # Returns (found, value) so cached "missing" entries (None) count as hits
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+results_cache = TTLCache()
+
+# Read-through cache in front of the analyses and advanced_analyses collections.
+# Returns a shallow copy so callers can reshape top-level fields.
+def read_document(collection, doc_id):
+    found, data = results_cache.get((collection, doc_id))
+    if not found:
+        data = get_storage().get_document(collection, doc_id)
+        # Basic analyses are only final once complete, advanced ones are written once
+        final = data is not None and (collection != "analyses" or data.get("status") == "complete")
+        results_cache.set((collection, doc_id), data, RESULTS_CACHE_TTL if final else RESULTS_CACHE_NEGATIVE_TTL)
+    return dict(data) if data is not None else None
+
+def invalidate_document(collection, doc_id):
+    results_cache.invalidate((collection, doc_id))
+
 # Check if analysis for this video already exists
 def check_existing_analysis_by_video(video_url):
     doc_id = generate_doc_id(video_url)
-    doc_ref = db.collection("analyses").document(doc_id).get()
-    if doc_ref.exists:
-        return doc_ref.to_dict()
-    return None
+    return read_document("analyses", doc_id)
+
+# ------ TIMELINE ENCODING -------
+
+# How timelines are written to Firestore: "rows" (one dict per second) or "columnar"
+TIMELINE_STORAGE_FORMAT = os.getenv("TIMELINE_STORAGE_FORMAT", "rows")
+TIMELINE_FORMATS = ("rows", "columnar")
+
+# Encode a per-second timeline as one array per series, optionally averaged down to N points
+def timeline_to_columnar(rows, points=None):
+    if isinstance(rows, dict):
+        rows = columnar_to_timeline(rows)
+    series_names = [key for key in (rows[0] if rows else {}) if key != "time"]
+    values = np.array([[row.get(name, 0) for name in series_names] for row in rows], dtype=np.float64).reshape(len(rows), len(series_names))
+    start = rows[0]["time"] if rows else 0
+    step = 1
+
+    if points and 0 < points < len(rows):
+        # Average consecutive seconds into buckets of equal width (the last one may be shorter)
+        step = -(-len(rows) // points)
+        edges = np.arange(0, len(rows), step)
+        counts = np.diff(np.append(edges, len(rows)))
+        values = np.add.reduceat(values, edges, axis=0) / counts[:, None]
+
+    return {
+        "format": "columnar",
+        "time": {"start": start, "step": step},
+        "length": len(values),
+        "series": {name: values[:, j].tolist() for j, name in enumerate(series_names)}
+    }
+
+# Decode a columnar timeline back into the row-based shape (rows are returned unchanged)
+def columnar_to_timeline(timeline):
+    if not isinstance(timeline, dict) or timeline.get("format") != "columnar":
+        return timeline
+    start = timeline["time"]["start"]
+    step = timeline["time"]["step"]
+    series = timeline["series"]
+    return [
+        {"time": start + i * step, **{name: values[i] for name, values in series.items()}}
+        for i in range(timeline["length"])
+    ]
+
+# Shape a stored timeline for a response, rows by default for existing consumers
+def format_timeline(timeline, timeline_format="rows", points=None):
+    if timeline_format == "columnar":
+        return timeline_to_columnar(timeline, points)
+    if points:
+        return columnar_to_timeline(timeline_to_columnar(timeline, points))
+    return columnar_to_timeline(timeline)
+
+def check_timeline_format(timeline_format):
+    if timeline_format not in TIMELINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"timeline_format must be one of {', '.join(TIMELINE_FORMATS)}")
+
+def store_timeline(timeline):
+    if TIMELINE_STORAGE_FORMAT == "columnar" and timeline:
+        return timeline_to_columnar(timeline)
+    return timeline
+
+# ------ STORAGE BACKENDS -------
+
+# "firestore" (default), "sqlite" (local file) or "memory" (in-process, for benchmarks and tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "firestore")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "arcscan.sqlite3")
+FIREBASE_CREDENTIALS = os.getenv("FIREBASE_CREDENTIALS", "firebase_credentials.json")
+
+# "single" keeps one document, "sharded" always splits, "auto" splits documents that
+# would come close to Firestore's 1 MiB limit
+ANALYSIS_STORAGE_LAYOUT = os.getenv("ANALYSIS_STORAGE_LAYOUT", "auto")
+SHARD_THRESHOLD_BYTES = int(os.getenv("SHARD_THRESHOLD_BYTES", "800000"))
+SENTENCES_PER_CHUNK = 500
+TIMELINE_SECONDS_PER_CHUNK = 600
+BLOB_CHUNK_BYTES = 700000
+
+# Large fields moved out of the header document, and how each one is chunked:
+# "items" by list position, "timeline" by seconds, "blob" by compressed bytes
+SHARDED_FIELDS = {
+    "analyses": {"sentences": "items", "timeline_data": "timeline", "transcription": "blob"},
+    # The dashboard reads sentence_emotions straight from the header, so only the timeline moves
+    "advanced_analyses": {"emotion_timeline": "timeline"},
+}
+
+def pack_chunk(value):
+    return zlib.compress(json.dumps(value, default=str).encode("utf-8"))
+
+def unpack_chunk(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+def chunk_id(field, index):
+    return f"{field}_{index:05d}"
+
+def split_field(kind, value):
+    if kind == "items":
+        return [pack_chunk(value[i:i + SENTENCES_PER_CHUNK]) for i in range(0, len(value), SENTENCES_PER_CHUNK)]
+    if kind == "timeline":
+        rows = columnar_to_timeline(value)
+        return [pack_chunk(rows[i:i + TIMELINE_SECONDS_PER_CHUNK]) for i in range(0, len(rows), TIMELINE_SECONDS_PER_CHUNK)]
+    packed = pack_chunk(value)
+    return [packed[i:i + BLOB_CHUNK_BYTES] for i in range(0, len(packed), BLOB_CHUNK_BYTES)]
+
+def should_shard(collection, data):
+    if ANALYSIS_STORAGE_LAYOUT == "sharded":
+        return True
+    if ANALYSIS_STORAGE_LAYOUT != "auto":
+        return False
+    return len(json.dumps(data, default=str)) > SHARD_THRESHOLD_BYTES
+
+def timeline_rows_in_range(timeline, start, end):
+    return [row for row in columnar_to_timeline(timeline or []) if start <= row["time"] < end]
+
+class StorageBackend:
+    """Persistence for analyses, advanced analyses, progress, history and leases.
+
+    Documents live in the collections "analyses", "advanced_analyses" and
+    "analysis_progress". Values equal to firestore.SERVER_TIMESTAMP are set to the
+    write time by every backend.
+    """
+
+    def get_document(self, collection, doc_id):
+        raise NotImplementedError
+
+    def put_document(self, collection, doc_id, data):
+        raise NotImplementedError
+
+    # Write several (collection, doc_id, data) documents together
+    def put_documents(self, documents):
+        for collection, doc_id, data in documents:
+            self.put_document(collection, doc_id, data)
+
+    # Timeline rows with start <= time < end, None when the document does not exist
+    def read_timeline_range(self, collection, doc_id, field, start, end):
+        data = self.get_document(collection, doc_id)
+        return None if data is None else timeline_rows_in_range(data.get(field), start, end)
+
+    # One page of a user's analyses, newest first: ([(doc_id, fields), ...], next_cursor).
+    # Raises KeyError for an unknown cursor, MissingIndex when the database lacks the query index.
+    def list_history(self, user_id, fields, limit, cursor=None):
+        raise NotImplementedError
+
+    # Take the lease on doc_id for job_id unless another live job holds it, returns the holder
+    def acquire_lease(self, doc_id, job_id, ttl):
+        raise NotImplementedError
+
+    def renew_lease(self, doc_id, job_id, ttl):
+        raise NotImplementedError
 
-# Save analysis to Firestore
-def save_analysis(user_id, video_url, transcription, sentence_results, summary, overall, timeline_data, status="complete"):
+    def release_lease(self, doc_id, job_id):
+        raise NotImplementedError
+
+class MissingIndex(Exception):
+    pass
+
+@firestore.transactional
+def _acquire_lease_transaction(transaction, lease_ref, job_id, ttl):
+    snapshot = lease_ref.get(transaction=transaction)
+    now = time.time()
+    if snapshot.exists:
+        current = snapshot.to_dict()
+        if current.get("expires_at", 0) > now and current.get("job_id") != job_id:
+            return current
+    lease = {"job_id": job_id, "owner": PROCESS_ID, "expires_at": now + ttl}
+    transaction.set(lease_ref, lease)
+    return lease
+
+# Only the job that holds the lease may extend it, a job whose lease expired and was
+# taken over must not take it back
+@firestore.transactional
+def _renew_lease_transaction(transaction, lease_ref, job_id, ttl):
+    snapshot = lease_ref.get(transaction=transaction)
+    if snapshot.exists and snapshot.to_dict().get("job_id") == job_id:
+        transaction.update(lease_ref, {"expires_at": time.time() + ttl})
+
+class FirestoreStorage(StorageBackend):
+    """Firestore backend, large analyses are sharded into a "chunks" subcollection."""
+
+    def __init__(self, credentials_path=FIREBASE_CREDENTIALS):
+        # Initialize Firebase
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_path))
+        self.db = firestore.client()
+
+    def _chunks(self, collection, doc_id):
+        return self.db.collection(collection).document(doc_id).collection("chunks")
+
+    # All chunks in one batched read, get_all returns the snapshots in any order
+    def _read_chunks(self, collection, doc_id, field, indexes):
+        chunks = self._chunks(collection, doc_id)
+        refs = [chunks.document(chunk_id(field, index)) for index in indexes]
+        if not refs:
+            return []
+        parts = {snapshot.id: snapshot.to_dict()["data"] for snapshot in self.db.get_all(refs)}
+        return [parts[ref.id] for ref in refs]
+
+    def get_document(self, collection, doc_id):
+        doc_ref = self.db.collection(collection).document(doc_id).get()
+        if not doc_ref.exists:
+            return None
+        data = doc_ref.to_dict()
+        if data.get("layout") != "sharded":
+            return data
+
+        # Rebuild the full document from a sharded header
+        header = data
+        data = {key: value for key, value in header.items() if key not in ("layout", "shards", "timeline_chunk_seconds")}
+        for field, shard in header.get("shards", {}).items():
+            parts = self._read_chunks(collection, doc_id, field, range(shard["chunks"]))
+            if shard["kind"] == "blob":
+                data[field] = unpack_chunk(b"".join(parts))
+            else:
+                data[field] = [item for part in parts for item in unpack_chunk(part)]
+        return data
+
+    # Write an analysis as one document, or as a small header plus compressed chunks in a
+    # "chunks" subcollection when it is too large for a single document
+    def put_document(self, collection, doc_id, data):
+        fields = SHARDED_FIELDS.get(collection, {})
+        if not fields or not should_shard(collection, data):
+            self.db.collection(collection).document(doc_id).set(data)
+            return
+
+        header = {key: value for key, value in data.items() if key not in fields}
+        shards = {}
+        chunks = self._chunks(collection, doc_id)
+        for field, kind in fields.items():
+            if field not in data:
+                continue
+            parts = split_field(kind, data[field])
+            for index, part in enumerate(parts):
+                chunks.document(chunk_id(field, index)).set({"field": field, "index": index, "data": part})
+            shards[field] = {"kind": kind, "chunks": len(parts)}
+        if "timeline_data" in shards or "emotion_timeline" in shards:
+            header["timeline_chunk_seconds"] = TIMELINE_SECONDS_PER_CHUNK
+        # Header last, readers only look for chunks once it says the document is sharded
+        self.db.collection(collection).document(doc_id).set({**header, "layout": "sharded", "shards": shards})
+
+    # Single documents are committed in one batch, sharded ones write their chunks first
+    def put_documents(self, documents):
+        batch = self.db.batch()
+        batched = 0
+        for collection, doc_id, data in documents:
+            if SHARDED_FIELDS.get(collection) and should_shard(collection, data):
+                self.put_document(collection, doc_id, data)
+            else:
+                batch.set(self.db.collection(collection).document(doc_id), data)
+                batched += 1
+        if batched:
+            batch.commit()
+
+    # Only the chunks covering the range are read
+    def read_timeline_range(self, collection, doc_id, field, start, end):
+        header_ref = self.db.collection(collection).document(doc_id).get()
+        if not header_ref.exists:
+            return None
+        header = header_ref.to_dict()
+        shard = header.get("shards", {}).get(field)
+        if header.get("layout") != "sharded" or shard is None:
+            return timeline_rows_in_range(header.get(field), start, end)
+        size = header.get("timeline_chunk_seconds", TIMELINE_SECONDS_PER_CHUNK)
+        first = max(0, int(start // size))
+        last = shard["chunks"] - 1 if end == float("inf") else min(shard["chunks"] - 1, int(max(start, end - 1) // size))
+        rows = [row for part in self._read_chunks(collection, doc_id, field, range(first, last + 1)) for row in unpack_chunk(part)]
+        return [row for row in rows if start <= row["time"] < end]
+
+    # Needs the composite index (user_id ascending, created_at descending) on "analyses" from
+    # backend/firestore.indexes.json: firebase deploy --only firestore:indexes
+    def list_history(self, user_id, fields, limit, cursor=None):
+        collection = self.db.collection("analyses")
+        query = (
+            collection.where("user_id", "==", user_id)
+            .order_by("created_at", direction=firestore.Query.DESCENDING)
+            .select(fields)
+        )
+        if cursor:
+            cursor_doc = collection.document(cursor).get()
+            if not cursor_doc.exists:
+                raise KeyError(cursor)
+            query = query.start_after(cursor_doc)
+
+        # One extra entry tells us whether there is a next page
+        try:
+            docs = list(query.limit(limit + 1).stream())
+        except FailedPrecondition as e:
+            raise MissingIndex(
+                "The history query needs the Firestore index in backend/firestore.indexes.json "
+                f"(firebase deploy --only firestore:indexes): {e}"
+            ) from e
+        page = docs[:limit]
+        return [(doc.id, doc.to_dict()) for doc in page], (page[-1].id if len(docs) > limit else None)
+
+    def _lease_ref(self, doc_id):
+        return self.db.collection("analysis_leases").document(doc_id)
+
+    def acquire_lease(self, doc_id, job_id, ttl):
+        return _acquire_lease_transaction(self.db.transaction(), self._lease_ref(doc_id), job_id, ttl)
+
+    def renew_lease(self, doc_id, job_id, ttl):
+        _renew_lease_transaction(self.db.transaction(), self._lease_ref(doc_id), job_id, ttl)
+
+    def release_lease(self, doc_id, job_id):
+        snapshot = self._lease_ref(doc_id).get()
+        if snapshot.exists and snapshot.to_dict().get("job_id") == job_id:
+            self._lease_ref(doc_id).delete()
+
+class LocalStorage(StorageBackend):
+    """SQLite stand-in for Firestore (path ":memory:" keeps everything in-process).
+
+    Documents are stored whole as JSON, there is no size limit to work around. Leases use
+    immediate transactions so several worker processes can share one database file.
+    """
+
+    def __init__(self, path=STORAGE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (collection TEXT, doc_id TEXT, user_id TEXT, "
+            "created_at REAL, data TEXT, PRIMARY KEY (collection, doc_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS documents_history ON documents (collection, user_id, created_at)")
+
+    @staticmethod
+    def _resolve(data):
+        now = datetime.now(timezone.utc)
+        return {key: now if value is firestore.SERVER_TIMESTAMP else value for key, value in data.items()}
+
+    @staticmethod
+    def _encode(data):
+        return json.dumps(data, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+    def get_document(self, collection, doc_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM documents WHERE collection = ? AND doc_id = ?", (collection, doc_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _row(self, collection, doc_id, data):
+        data = self._resolve(data)
+        created_at = data.get("created_at")
+        created_at = created_at.timestamp() if isinstance(created_at, datetime) else time.time()
+        return (collection, doc_id, data.get("user_id"), created_at, self._encode(data))
+
+    def put_document(self, collection, doc_id, data):
+        self.put_documents([(collection, doc_id, data)])
+
+    # One transaction for all documents
+    def put_documents(self, documents):
+        rows = [self._row(collection, doc_id, data) for collection, doc_id, data in documents]
+        with self._lock:
+            with self._conn:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO documents (collection, doc_id, user_id, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+    def list_history(self, user_id, fields, limit, cursor=None):
+        query = "SELECT doc_id, data FROM documents WHERE collection = 'analyses' AND user_id = ?"
+        params = [user_id]
+        with self._lock:
+            if cursor:
+                row = self._conn.execute(
+                    "SELECT created_at FROM documents WHERE collection = 'analyses' AND doc_id = ?", (cursor,)
+                ).fetchone()
+                if row is None:
+                    raise KeyError(cursor)
+                query += " AND (created_at < ? OR (created_at = ? AND doc_id < ?))"
+                params += [row[0], row[0], cursor]
+            query += " ORDER BY created_at DESC, doc_id DESC LIMIT ?"
+            rows = self._conn.execute(query, params + [limit + 1]).fetchall()
+        page = [(doc_id, {field: value for field, value in json.loads(data).items() if field in fields}) for doc_id, data in rows[:limit]]
+        return page, (page[-1][0] if len(rows) > limit else None)
+
+    def acquire_lease(self, doc_id, job_id, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT data FROM documents WHERE collection = 'analysis_leases' AND doc_id = ?", (doc_id,)
+                ).fetchone()
+                current = json.loads(row[0]) if row else None
+                if current and current.get("expires_at", 0) > now and current.get("job_id") != job_id:
+                    lease = current
+                else:
+                    lease = {"job_id": job_id, "owner": PROCESS_ID, "expires_at": now + ttl}
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO documents (collection, doc_id, user_id, created_at, data) VALUES ('analysis_leases', ?, NULL, ?, ?)",
+                        (doc_id, now, json.dumps(lease))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return lease
+
+    def renew_lease(self, doc_id, job_id, ttl):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE documents SET data = ? WHERE collection = 'analysis_leases' AND doc_id = ? AND json_extract(data, '$.job_id') = ?",
+                (json.dumps({"job_id": job_id, "owner": PROCESS_ID, "expires_at": time.time() + ttl}), doc_id, job_id)
+            )
+
+    def release_lease(self, doc_id, job_id):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM documents WHERE collection = 'analysis_leases' AND doc_id = ? AND json_extract(data, '$.job_id') = ?",
+                (doc_id, job_id)
+            )
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == "firestore":
+        return FirestoreStorage()
+    if backend == "sqlite":
+        return LocalStorage(STORAGE_PATH)
+    if backend == "memory":
+        return LocalStorage(":memory:")
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+storage = None
+storage_lock = threading.Lock()
+
+# Connect on first use (or from the startup hook), not at import
+def get_storage():
+    global storage
+    if storage is None:
+        with storage_lock:
+            if storage is None:
+                storage = create_storage()
+    return storage
+
+# Save analysis to Firestore (background=True hands the write to the progress writer)
+# advanced holds the emotion results of a fused run, saved to advanced_analyses in the same write
+def save_analysis(user_id, video_url, transcription, sentence_results, summary, overall, timeline_data, status="complete", background=False, advanced=None):
     doc_id = generate_doc_id(video_url)
     data = {
         "user_id": user_id,
@@ -99,7 +686,7 @@ def save_analysis(user_id, video_url, transcription, sentence_results, summary,
         "sentences": sentence_results,
         "summary": summary,
         "overall_sentiment": overall,
-        "timeline_data": timeline_data,
+        "timeline_data": store_timeline(timeline_data),
         "status": status,
         "created_at": firestore.SERVER_TIMESTAMP
     }
@@ -110,53 +697,746 @@ def save_analysis(user_id, video_url, transcription, sentence_results, summary,
         data["translated_text"] = transcription.get("translated_text")
         data["detected_language"] = transcription.get("detected_language")
     
-    db.collection("analyses").document(doc_id).set(data)
+    if background:
+        progress_writer.submit("analyses", doc_id, data, force=True)
+    else:
+        # A queued partial result must not land after (and overwrite) this one
+        progress_writer.drop("analyses", doc_id)
+        documents = [("analyses", doc_id, data)]
+        if advanced is not None:
+            documents.append(("advanced_analyses", doc_id, advanced_document(user_id, video_url, **advanced)))
+        get_storage().put_documents(documents)
+        if advanced is not None:
+            invalidate_document("advanced_analyses", doc_id)
+    invalidate_document("analyses", doc_id)
+
+def advanced_document(user_id, video_url, sentence_emotions, emotion_timeline, emotion_summary):
+    return {
+        "user_id": user_id,
+        "video_url": video_url,
+        "sentence_emotions": sentence_emotions,
+        "emotion_timeline": store_timeline(emotion_timeline),
+        "emotion_summary": emotion_summary,
+        "created_at": firestore.SERVER_TIMESTAMP
+    }
+
+# ------ PROGRESS PUB/SUB -------
+
+# Statuses after which no more progress events follow
+TERMINAL_PROGRESS_STATUSES = {"complete", "error", "cancelled", "complete_advanced", "error_advanced"}
+# Statuses written by the advanced analysis, the ones /progress/advanced reports
+ADVANCED_PROGRESS_STATUSES = {"queued_advanced", "analyzing_advanced", "complete_advanced", "error_advanced"}
+
+class ProgressBroker:
+    """In-process pub/sub of progress updates, feeds the streaming progress endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+        self._latest = {}
+
+    def publish(self, doc_id, event):
+        with self._lock:
+            # Terminal events stay until they are stored, see release()
+            self._latest[doc_id] = event
+            subscribers = list(self._subscribers.get(doc_id, ()))
+        # Publishers run on worker threads, hand the event to each subscriber's event loop
+        for loop, events in subscribers:
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, event)
+            except RuntimeError:
+                pass
+
+    def latest(self, doc_id):
+        return self._latest.get(doc_id)
+
+    # Called once the event is in Firestore, later readers get the final state from there
+    def release(self, doc_id, event):
+        with self._lock:
+            if self._latest.get(doc_id) is event:
+                del self._latest[doc_id]
+
+    def subscribe(self, doc_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers.setdefault(doc_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, doc_id, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(doc_id, set())
+            subscribers.discard(subscriber)
+            if not subscribers:
+                self._subscribers.pop(doc_id, None)
+
+progress_broker = ProgressBroker()
+
+# Minimum seconds between two Firestore writes of the same progress document
+PROGRESS_WRITE_INTERVAL = float(os.getenv("PROGRESS_WRITE_INTERVAL", "1.0"))
+
+class ProgressWriter:
+    """Writes progress (and partial result) documents to Firestore on a background thread.
+
+    Updates to the same document are coalesced so only the newest one is written, and each
+    document is written at most once per interval. Forced writes (terminal statuses,
+    partial results) skip the interval and are never dropped. on_written is called after
+    a successful write of that update (not for updates coalesced away).
+    """
+
+    def __init__(self, interval=PROGRESS_WRITE_INTERVAL):
+        self.interval = interval
+        self._pending = OrderedDict()
+        self._writing = set()
+        self._last_write = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self.writes = 0
+        self.coalesced = 0
+
+    def submit(self, collection, doc_id, data, force=False, on_written=None):
+        key = (collection, doc_id)
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+                force = force or self._pending[key][1]
+            self._pending[key] = (data, force, on_written)
+            # Newest update goes last so documents are written in the order they changed
+            self._pending.move_to_end(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def drop(self, collection, doc_id):
+        # Forget a pending write and wait for one in flight, used before a newer synchronous write
+        key = (collection, doc_id)
+        with self._condition:
+            self._pending.pop(key, None)
+            while key in self._writing:
+                self._condition.wait(0.05)
+
+    def flush(self, timeout=10):
+        # Wait until everything submitted so far has been written (ignores the interval)
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            for key, (data, _, on_written) in self._pending.items():
+                self._pending[key] = (data, True, on_written)
+            self._condition.notify()
+            while (self._pending or self._writing) and time.monotonic() < deadline:
+                self._condition.wait(0.05)
+            return not self._pending and not self._writing
+
+    def _ready(self, now):
+        ready, next_due = [], None
+        for key, (data, force, _) in self._pending.items():
+            due = self._last_write.get(key, float("-inf")) + self.interval
+            if force or now >= due:
+                ready.append(key)
+            else:
+                next_due = due if next_due is None else min(next_due, due)
+        return ready, next_due
+
+    def _run(self):
+        while True:
+            with self._condition:
+                ready, next_due = self._ready(time.monotonic())
+                while not ready:
+                    self._condition.wait(None if next_due is None else max(0.0, next_due - time.monotonic()))
+                    ready, next_due = self._ready(time.monotonic())
+                batch = [(key, self._pending.pop(key)) for key in ready]
+                self._writing.update(ready)
+
+            for (collection, doc_id), (data, _, on_written) in batch:
+                try:
+                    get_storage().put_document(collection, doc_id, data)
+                    self.writes += 1
+                    if on_written:
+                        on_written()
+                except Exception as e:
+                    print(f"Background write to {collection}/{doc_id} failed: {e}")
+                self._last_write[(collection, doc_id)] = time.monotonic()
+
+            with self._condition:
+                self._writing.clear()
+                self._condition.notify_all()
+
+progress_writer = ProgressWriter()
+atexit.register(progress_writer.flush)
 
 # Update progress in Firestore
-def update_progress(video_url, user_id, status, progress, message=""):
+def update_progress(video_url, user_id, status, progress, message="", job_id=None):
     doc_id = generate_doc_id(video_url)
-    db.collection("analysis_progress").document(doc_id).set({
+    data = {
         "user_id": user_id,
         "video_url": video_url,
         "status": status,
         "progress": progress,
-        "message": message,
-        "updated_at": firestore.SERVER_TIMESTAMP
-    })
+        "message": message
+    }
+    if job_id:
+        data["job_id"] = job_id
+    event = {**data, "updated_at": time.time()}
+    progress_broker.publish(doc_id, event)
+    # Written asynchronously, terminal states are always flushed. The broker keeps serving
+    # a terminal event until it is written, Firestore may still hold an older status.
+    terminal = status in TERMINAL_PROGRESS_STATUSES
+    progress_writer.submit(
+        "analysis_progress", doc_id, {**data, "updated_at": firestore.SERVER_TIMESTAMP},
+        force=terminal,
+        on_written=(lambda: progress_broker.release(doc_id, event)) if terminal else None
+    )
 
-# Download audio from YouTube
-def download_youtube_audio(youtube_url, output_dir="downloads"):
-    os.makedirs(output_dir, exist_ok=True)
-    unique_id = str(uuid.uuid4())
-    output_path = os.path.join(output_dir, f"audio_{unique_id}")
-    ydl_opts = {
+# ------ AUDIO DOWNLOAD -------
+
+# "native" keeps a low bitrate stream as is, "speech" re-encodes to 16 kHz mono Opus,
+# "mp3" is the old 192 kbps MP3 re-encode
+AUDIO_PROFILE = os.getenv("AUDIO_PROFILE", "native")
+# Containers Whisper accepts without conversion
+WHISPER_AUDIO_FORMATS = {".flac", ".m4a", ".mp3", ".mp4", ".mpeg", ".mpga", ".oga", ".ogg", ".wav", ".webm"}
+# 16 kHz mono is all speech recognition needs
+SPEECH_FFMPEG_ARGS = ["-vn", "-ac", "1", "-ar", "16000", "-c:a", "libopus", "-b:a", "24k"]
+
+AUDIO_PROFILES = {
+    "native": {
+        # Prefer a low bitrate Opus/AAC stream, nothing is re-encoded
+        "format": "bestaudio[abr<=96][ext=webm]/bestaudio[abr<=96][ext=m4a]/bestaudio[ext=webm]/bestaudio[ext=m4a]/bestaudio/best",
+    },
+    "speech": {
+        "format": "bestaudio/best",
+        "postprocessors": [{
+            "key": "FFmpegExtractAudio",
+            "preferredcodec": "opus",
+        }],
+        "postprocessor_args": {"extractaudio": SPEECH_FFMPEG_ARGS[1:]},
+    },
+    "mp3": {
         "format": "bestaudio/best",
-        "outtmpl": output_path,
         "postprocessors": [{
             "key": "FFmpegExtractAudio",
             "preferredcodec": "mp3",
             "preferredquality": "192",
         }],
+    },
+}
+
+# Re-encode any audio file to 16 kHz mono Opus in an Ogg container
+def transcode_for_speech(path):
+    output_path = os.path.splitext(path)[0] + ".ogg"
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", path, *SPEECH_FFMPEG_ARGS, output_path],
+        check=True
+    )
+    os.remove(path)
+    return output_path
+
+# Download audio from YouTube, returns the path of the file that was actually written
+def download_youtube_audio(youtube_url, output_dir="downloads", profile=None):
+    profile = profile or AUDIO_PROFILE
+    if profile not in AUDIO_PROFILES:
+        raise HTTPException(status_code=500, detail=f"Unknown audio profile: {profile}")
+    os.makedirs(output_dir, exist_ok=True)
+    unique_id = str(uuid.uuid4())
+    output_path = os.path.join(output_dir, f"audio_{unique_id}")
+    ydl_opts = {
+        "outtmpl": output_path + ".%(ext)s",
+        **AUDIO_PROFILES[profile],
     }
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([youtube_url])
-        return output_path + ".mp3"
+            info = ydl.extract_info(youtube_url, download=True)
+        downloads = info.get("requested_downloads") or [{}]
+        audio_path = downloads[0].get("filepath") or ydl.prepare_filename(info)
+
+        extension = os.path.splitext(audio_path)[1].lower()
+        if extension == ".opus":
+            # Same Opus stream, but Whisper only knows the .ogg name
+            os.rename(audio_path, output_path + ".ogg")
+            audio_path = output_path + ".ogg"
+        elif extension not in WHISPER_AUDIO_FORMATS:
+            audio_path = transcode_for_speech(audio_path)
+        return audio_path
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Download error: {e}")
 
+# ------ MEDIA CACHE -------
+
+# Size limit of the local audio/transcript cache in bytes (0 disables it)
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class MediaCache:
+    """Content-addressed cache of downloaded audio and raw Whisper responses.
+
+    audio/<sha256><ext> holds the audio, transcripts/<sha256>.json the Whisper response for
+    that audio and videos/<video id>.json points a canonical video id at its audio. Files are
+    touched on every hit and the least recently used ones are evicted over max_bytes.
+    Audio returned by lookup_audio/store_audio is not evicted until release_audio.
+    """
+
+    def __init__(self, root=None, max_bytes=MEDIA_CACHE_MAX_BYTES):
+        self.root = root or os.path.join(CACHE_DIR, "media")
+        self.max_bytes = max_bytes
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+        # Audio paths that running jobs are still reading (probing, chunking), with a count per job
+        self._in_use = Counter()
+        for folder in ("audio", "transcripts", "videos"):
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, folder, name):
+        return os.path.join(self.root, folder, name)
+
+    def _touch(self, *paths):
+        for path in paths:
+            os.utime(path)
+
+    def owns(self, path):
+        return os.path.abspath(path).startswith(os.path.abspath(self._path("audio", "")))
+
+    def audio_hash(self, path):
+        if self.owns(path):
+            return os.path.splitext(os.path.basename(path))[0]
+        return file_sha256(path)
+
+    def lookup_audio(self, video_id):
+        index_path = self._path("videos", f"{video_id}.json")
+        try:
+            with open(index_path) as f:
+                audio_path = self._path("audio", json.load(f)["audio"])
+        except (OSError, ValueError, KeyError):
+            audio_path = None
+        if audio_path:
+            # Checked and marked in use under the eviction lock, so it cannot go in between
+            with self._lock:
+                found = os.path.exists(audio_path)
+                if found:
+                    self._in_use[audio_path] += 1
+            if found:
+                try:
+                    self._touch(index_path, audio_path)
+                except OSError:
+                    pass
+                self.hits["audio"] += 1
+                return audio_path
+        self.misses["audio"] += 1
+        return None
+
+    # Move a downloaded file into the cache and return its cached path
+    def store_audio(self, video_id, path):
+        name = file_sha256(path) + os.path.splitext(path)[1]
+        audio_path = self._path("audio", name)
+        with self._lock:
+            os.replace(path, audio_path)
+            self._in_use[audio_path] += 1
+        if video_id:
+            with open(self._path("videos", f"{video_id}.json"), "w") as f:
+                json.dump({"audio": name}, f)
+        self.evict()
+        return audio_path
+
+    # The job is done with audio from lookup_audio/store_audio, it may be evicted again
+    def release_audio(self, path):
+        with self._lock:
+            self._in_use[path] -= 1
+            if self._in_use[path] <= 0:
+                del self._in_use[path]
+
+    def get_transcript(self, audio_hash):
+        transcript_path = self._path("transcripts", f"{audio_hash}.json")
+        try:
+            with open(transcript_path) as f:
+                transcript = json.load(f)
+            self._touch(transcript_path)
+            self.hits["transcript"] += 1
+            return transcript
+        except (OSError, ValueError):
+            self.misses["transcript"] += 1
+            return None
+
+    def put_transcript(self, audio_hash, transcript):
+        transcript_path = self._path("transcripts", f"{audio_hash}.json")
+        with open(transcript_path + ".tmp", "w") as f:
+            json.dump(transcript, f)
+        os.replace(transcript_path + ".tmp", transcript_path)
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for folder in ("audio", "transcripts", "videos"):
+                for entry in os.scandir(self._path(folder, "")):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path in self._in_use:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": dict(self.hits), "misses": dict(self.misses)}
+
+media_cache = None
+
+def get_media_cache():
+    global media_cache
+    if media_cache is None:
+        media_cache = MediaCache()
+    return media_cache
+
+# Download audio, or reuse the cached audio of the same video from any URL variant.
+# Cached audio stays in use until the caller passes it to release_audio.
+def fetch_audio(video_url):
+    cache = get_media_cache()
+    video_id = extract_video_id(video_url)
+    if not cache.enabled:
+        return download_youtube_audio(video_url)
+    if video_id:
+        cached = cache.lookup_audio(video_id)
+        if cached:
+            return cached
+    return cache.store_audio(video_id, download_youtube_audio(video_url))
+
+# Raw Whisper response for this audio, from the cache when the same audio was transcribed before
+def cached_transcription(source, backend):
+    cache = get_media_cache()
+    if not cache.enabled or not isinstance(source, (str, os.PathLike)):
+        return transcribe_in_chunks(source, backend)
+    audio_hash = cache.audio_hash(source)
+    transcript = cache.get_transcript(audio_hash)
+    if transcript is None:
+        transcript = transcribe_in_chunks(source, backend)
+        cache.put_transcript(audio_hash, transcript)
+    return transcript
+
+# ------ CHUNKED TRANSCRIPTION -------
+
+# Target length of each transcription chunk in seconds
+TRANSCRIBE_CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "600"))
+# Extra audio on each side of a chunk so words at the cut are not lost
+TRANSCRIBE_CHUNK_OVERLAP = float(os.getenv("TRANSCRIBE_CHUNK_OVERLAP", "2"))
+# Maximum number of chunks sent to Whisper at the same time
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))
+# Whisper rejects uploads over 25 MB, keep some margin
+WHISPER_MAX_UPLOAD_BYTES = int(os.getenv("WHISPER_MAX_UPLOAD_BYTES", str(24 * 1024 * 1024)))
+
+# Default transcription backend: takes an open audio file, returns a verbose_json response
+def whisper_backend(audio_file):
+    return get_openai().Audio.transcribe(
+        model="whisper-1", 
+        file=audio_file,
+        response_format="verbose_json",  # Get detailed output with timestamps
+        timestamp_granularities=["segment"]  # Get segment-level timestamps
+    )
+
+def probe_audio_duration(path):
+    output = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", path],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip())
+
+# Find silent stretches with ffmpeg's silencedetect filter, as (start, end) pairs
+def detect_silences(path, noise_db=-35, min_silence=0.4):
+    stderr = subprocess.run(
+        ["ffmpeg", "-hide_banner", "-nostats", "-i", path, "-af", f"silencedetect=noise={noise_db}dB:d={min_silence}", "-f", "null", "-"],
+        capture_output=True, text=True
+    ).stderr
+    starts = [float(x) for x in re.findall(r"silence_start: (-?[\d.]+)", stderr)]
+    ends = [float(x) for x in re.findall(r"silence_end: (-?[\d.]+)", stderr)]
+    return list(zip(starts, ends))
+
+# Split [0, duration] into chunks cut in the middle of silences close to every chunk_seconds.
+# Each chunk owns [own_start, own_end) and is extracted with overlap on both sides.
+def plan_audio_chunks(duration, silences, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS, overlap=TRANSCRIBE_CHUNK_OVERLAP):
+    midpoints = sorted((start + end) / 2 for start, end in silences)
+    search = chunk_seconds / 5
+    cuts = [0.0]
+    while duration - cuts[-1] > chunk_seconds * 1.2:
+        target = cuts[-1] + chunk_seconds
+        nearby = [m for m in midpoints if abs(m - target) <= search and m > cuts[-1]]
+        cuts.append(min(nearby, key=lambda m: abs(m - target)) if nearby else target)
+    cuts.append(duration)
+
+    return [
+        {
+            "start": max(0.0, own_start - overlap),
+            "end": min(duration, own_end + overlap),
+            "own_start": own_start,
+            "own_end": own_end
+        }
+        for own_start, own_end in zip(cuts, cuts[1:])
+    ]
+
+def extract_audio_chunk(path, start, end, output_dir):
+    extension = os.path.splitext(path)[1] or ".ogg"
+    chunk_path = os.path.join(output_dir, f"chunk_{start:.2f}{extension}")
+    subprocess.run(
+        ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-ss", f"{start:.3f}", "-t", f"{end - start:.3f}",
+         "-i", path, "-vn", "-c", "copy", chunk_path],
+        check=True
+    )
+    return chunk_path
+
+# Shift each chunk's segments to video time and keep the ones whose midpoint the chunk owns
+def merge_chunk_transcripts(chunks, responses):
+    segments = []
+    for chunk, response in zip(chunks, responses):
+        last = chunk is chunks[-1]
+        for segment in response.get("segments", []):
+            segment = dict(segment)
+            segment["start"] = segment.get("start", 0) + chunk["start"]
+            segment["end"] = segment.get("end", 0) + chunk["start"]
+            midpoint = (segment["start"] + segment["end"]) / 2
+            if chunk["own_start"] <= midpoint and (midpoint < chunk["own_end"] or last):
+                segments.append(segment)
+
+    for i, segment in enumerate(segments):
+        segment["id"] = i
+    return {
+        "task": "transcribe",
+        "language": responses[0].get("language") if responses else None,
+        "duration": chunks[-1]["own_end"] if chunks else 0,
+        "text": " ".join(segment.get("text", "").strip() for segment in segments),
+        "segments": segments
+    }
+
+# Open audio given as a path, bytes or a file-like object. Whisper detects the format
+# from the file name, so buffers get a name (their own if they have one).
+@contextmanager
+def open_audio(source, name="audio.ogg"):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield f
+        return
+    data = source if isinstance(source, (bytes, bytearray)) else source.read()
+    buffer = io.BytesIO(data)
+    buffer.name = os.path.basename(getattr(source, "name", None) or name)
+    yield buffer
+
+def transcribe_file(source, backend):
+    with open_audio(source) as f:
+        return backend(f)
+
+# Transcribe short audio in one call, long or large audio in parallel silence-aligned chunks.
+# `source` may be a path or an in-memory buffer.
+def transcribe_in_chunks(source, backend=whisper_backend, chunk_seconds=TRANSCRIBE_CHUNK_SECONDS, concurrency=TRANSCRIBE_CONCURRENCY):
+    if not isinstance(source, (str, os.PathLike)):
+        with open_audio(source) as buffer:
+            if len(buffer.getvalue()) <= WHISPER_MAX_UPLOAD_BYTES:
+                return backend(buffer)
+            # ffmpeg needs a real file to split large buffers
+            spool_dir = tempfile.mkdtemp(prefix="audio_")
+            try:
+                path = os.path.join(spool_dir, buffer.name)
+                with open(path, "wb") as f:
+                    f.write(buffer.getvalue())
+                return transcribe_in_chunks(path, backend, chunk_seconds, concurrency)
+            finally:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+    path = source
+    size = os.path.getsize(path)
+    duration = probe_audio_duration(path)
+    if size > WHISPER_MAX_UPLOAD_BYTES:
+        # Make sure every chunk (with overlap) fits in one upload
+        chunk_seconds = min(chunk_seconds, duration * WHISPER_MAX_UPLOAD_BYTES / size * 0.8)
+    elif duration <= chunk_seconds * 1.2:
+        return transcribe_file(path, backend)
+
+    chunks = plan_audio_chunks(duration, detect_silences(path), chunk_seconds)
+    chunk_dir = tempfile.mkdtemp(prefix="chunks_")
+    try:
+        paths = [extract_audio_chunk(path, chunk["start"], chunk["end"], chunk_dir) for chunk in chunks]
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+            responses = list(pool.map(lambda p: transcribe_file(p, backend), paths))
+    finally:
+        shutil.rmtree(chunk_dir, ignore_errors=True)
+    return merge_chunk_transcripts(chunks, responses)
+
+# ------ LOCAL CACHE -------
+
+# Files live under CACHE_DIR (defined in classifiers.py), shared by every worker on the host
+class KeyValueCache:
+    """Small persistent JSON key/value cache in SQLite, evicts least recently used entries."""
+
+    def __init__(self, name, max_entries=100000, cache_dir=None):
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, f"{name}.sqlite3")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, last_used REAL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._conn.commit()
+
+    def get_many(self, keys):
+        found = {}
+        with self._lock:
+            unique = list(dict.fromkeys(keys))
+            for i in range(0, len(unique), 500):
+                part = unique[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE cache SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def set_many(self, items):
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, last_used) VALUES (?, ?, ?)",
+                [(key, json.dumps(value), now) for key, value in items.items()]
+            )
+            # Evict the least recently used entries over the limit
+            self._conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+# ------ TRANSLATION -------
+
+# Approximate prompt tokens per segment batch
+TRANSLATION_BATCH_TOKENS = int(os.getenv("TRANSLATION_BATCH_TOKENS", "1500"))
+# Maximum ChatCompletion calls in flight across all jobs in this process
+TRANSLATION_CONCURRENCY = int(os.getenv("TRANSLATION_CONCURRENCY", "4"))
+TRANSLATION_MAX_RETRIES = 5
+
+translation_semaphore = threading.BoundedSemaphore(TRANSLATION_CONCURRENCY)
+translation_cache = None
+
+def get_translation_cache():
+    global translation_cache
+    if translation_cache is None:
+        translation_cache = KeyValueCache("translations")
+    return translation_cache
+
+def translation_cache_key(lang, text):
+    return f"{lang}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+# Rough token count, Hebrew and Arabic use more tokens per character than English
+def estimate_tokens(text):
+    return len(text) // 2 + 1
+
+# Group texts into batches that stay under max_tokens each
+def batch_by_tokens(texts, max_tokens=TRANSLATION_BATCH_TOKENS):
+    batches, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+# Translate one numbered batch, waits for a free slot and backs off when rate limited
+def translate_batch(batch, lang):
+    # Create a numbered list of segments for translation
+    combined_text = "\n".join(f"{j+1}. {text}" for j, text in enumerate(batch))
+    openai = get_openai()
+    delay = 1
+    for attempt in range(TRANSLATION_MAX_RETRIES):
+        try:
+            with translation_semaphore:
+                response = openai.ChatCompletion.create(
+                    model="gpt-3.5-turbo",
+                    messages=[
+                        {"role": "system", "content": f"You are a professional translator from {lang} to English. Translate each numbered segment below from {lang} to English. Keep the same numbering format in your response (1., 2., etc.) and translate each segment on its own line:"},
+                        {"role": "user", "content": combined_text}
+                    ],
+                    temperature=0.3  # Lower temperature for more accurate translations
+                )
+            break
+        except openai.error.RateLimitError:
+            if attempt == TRANSLATION_MAX_RETRIES - 1:
+                raise
+            time.sleep(delay)
+            delay *= 2
+
+    # Parse the translated segments, missing lines stay untranslated (None)
+    translations = [None] * len(batch)
+    for line in response.choices[0].message['content'].strip().split('\n'):
+        match = re.match(r"\s*(\d+)\.\s*(.*)", line)
+        if match and 1 <= int(match.group(1)) <= len(batch):
+            translations[int(match.group(1)) - 1] = match.group(2).strip()
+    return translations
+
+# Translate texts to English, each distinct text is sent at most once and cached across runs
+def translate_segments(texts, lang):
+    cache = get_translation_cache()
+    keys = {text: translation_cache_key(lang, text) for text in texts}
+    cached = cache.get_many(list(keys.values()))
+    translated = {text: cached[key] for text, key in keys.items() if key in cached}
+
+    missing = [text for text in dict.fromkeys(texts) if text not in translated]
+    batches = batch_by_tokens(missing)
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(TRANSLATION_CONCURRENCY, len(batches)))) as pool:
+            results = list(pool.map(lambda batch: translate_batch(batch, lang), batches))
+        new_entries = {}
+        for batch, translations in zip(batches, results):
+            for text, translation in zip(batch, translations):
+                if translation:
+                    translated[text] = translation
+                    new_entries[keys[text]] = translation
+        cache.set_many(new_entries)
+
+    return [translated.get(text) for text in texts]
+
 # Transcribe audio to text using Whisper
 # A more optimized version that reduces API calls by batching segments
 
-def transcribe_audio(path):
+def transcribe_audio(path, backend=whisper_backend):
     try:
-        with open(path, "rb") as f:
-            result = openai.Audio.transcribe(
-                model="whisper-1", 
-                file=f,
-                response_format="verbose_json",  # Get detailed output with timestamps
-                timestamp_granularities=["segment"]  # Get segment-level timestamps
-            )
+        with stage_seconds.time(stage="transcribe"):
+            result = cached_transcription(path, backend)
+        if result.get("duration"):
+            audio_seconds.observe(result["duration"])
+        segment_count.observe(len(result.get("segments", [])))
         
         # Get the transcribed text
         text = result.get("text", "")
@@ -169,70 +1449,27 @@ def transcribe_audio(path):
                 
                 # Only translate Hebrew or Arabic
                 if detected_lang in ['he', 'ar']:
-                    # Store original text and language
-                    original_text = text
-                    original_lang = detected_lang
-                    
-                    # Use GPT for translation
-                    translation_response = openai.ChatCompletion.create(
-                        model="gpt-3.5-turbo",
-                        messages=[
-                            {"role": "system", "content": f"You are a professional translator from {detected_lang} to English. Translate the following text accurately while preserving the meaning and tone:"},
-                            {"role": "user", "content": text}
-                        ],
-                        temperature=0.3  # Lower temperature for more accurate translations
+                    segments = [seg for seg in result.get("segments", []) if seg.get("text", "").strip()]
+                    segment_texts = [seg["text"].strip() for seg in segments] or [text.strip()]
+
+                    # Translate segments concurrently, then build the full translation from them
+                    with stage_seconds.time(stage="translate"):
+                        translations = translate_segments(segment_texts, detected_lang)
+                    for seg, translation in zip(segments, translations):
+                        if translation:
+                            seg["original_text"] = seg.get("text", "")
+                            seg["text"] = translation
+                    translated_text = " ".join(
+                        translation or original for original, translation in zip(segment_texts, translations)
                     )
                     
-                    # Extract translated text from response
-                    translated_text = translation_response.choices[0].message['content'].strip()
-                    
                     # Store the translated text in the result
-                    result["original_text"] = original_text
+                    result["original_text"] = text
                     result["translated_text"] = translated_text
                     result["detected_language"] = detected_lang
                     
                     # Replace the text with translated version for analysis
                     result["text"] = translated_text
-                    
-                    # Batch translate segments to reduce API calls
-                    # Group segments into batches of 10
-                    segments = result.get("segments", [])
-                    batch_size = 10
-                    for i in range(0, len(segments), batch_size):
-                        batch = segments[i:i+batch_size]
-                        
-                        # Skip empty segments
-                        if not batch:
-                            continue
-                            
-                        # Create a numbered list of segments for translation
-                        segment_texts = [f"{j+1}. {seg.get('text', '').strip()}" for j, seg in enumerate(batch)]
-                        combined_text = "\n".join(segment_texts)
-                        
-                        # Translate the batch
-                        batch_translation = openai.ChatCompletion.create(
-                            model="gpt-3.5-turbo",
-                            messages=[
-                                {"role": "system", "content": f"You are a professional translator from {detected_lang} to English. Translate each numbered segment below from {detected_lang} to English. Keep the same numbering format in your response (1., 2., etc.) and translate each segment on its own line:"},
-                                {"role": "user", "content": combined_text}
-                            ],
-                            temperature=0.3
-                        )
-                        
-                        # Parse the translated segments
-                        translated_batch = batch_translation.choices[0].message['content'].strip()
-                        translated_lines = translated_batch.split('\n')
-                        
-                        # Update each segment with its translation
-                        for j, seg in enumerate(batch):
-                            # Find the corresponding translated line
-                            for line in translated_lines:
-                                if line.startswith(f"{j+1}."):
-                                    # Extract translation (remove the numbering)
-                                    translation = line[line.find(".")+1:].strip()
-                                    seg["original_text"] = seg.get("text", "")
-                                    seg["text"] = translation
-                                    break
             except Exception as e:
                 # If translation fails, just continue with original text
                 print(f"Translation error: {e}")
@@ -260,12 +1497,68 @@ def extract_sentences_with_timestamps(whisper_response):
     
     return sentences
 
+# ------ CLASSIFICATION CACHE -------
+
+# Classifier outputs by model and sentence text, so repeated sentences ("Thank you.",
+# "[Music]", sponsor reads) skip inference. Shared by all workers using the same CACHE_DIR.
+CLASSIFICATION_CACHE = os.getenv("CLASSIFICATION_CACHE", "true").lower() == "true"
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "200000"))
+
+classification_cache = None
+
+def get_classification_cache():
+    global classification_cache
+    if classification_cache is None:
+        classification_cache = KeyValueCache("classifications", max_entries=CLASSIFICATION_CACHE_SIZE)
+    return classification_cache
+
+# Unicode and whitespace normalization only, both models are case sensitive
+def normalize_sentence(text):
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+# The backend is part of the key, ONNX/int8 scores differ slightly from PyTorch. It is the
+# backend of the classifier that runs the model (the inference server's for a RemoteClassifier).
+def classification_cache_key(model_name, text, backend=None):
+    model_id = f"{MODEL_SPECS[model_name]['model']}@{backend or MODEL_BACKEND}"
+    return f"{model_id}:{hashlib.sha256(normalize_sentence(text).encode('utf-8')).hexdigest()}"
+
+# run_batched_inference for cached and repeated sentences: only texts not in the cache are
+# classified, each distinct text once. Failed outputs (None) are not cached.
+def run_cached_inference(classifier, texts, model_name="sentiment", **kwargs):
+    if not CLASSIFICATION_CACHE:
+        return run_batched_inference(classifier, texts, model_name=model_name, **kwargs)
+    cache = get_classification_cache()
+    keys = [classification_cache_key(model_name, text, getattr(classifier, "backend", None)) for text in texts]
+    outputs = cache.get_many(keys)
+
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in outputs and key not in missing:
+            missing[key] = text
+    if missing:
+        new_outputs = run_batched_inference(classifier, list(missing.values()), model_name=model_name, **kwargs)
+        new_entries = {key: output for key, output in zip(missing, new_outputs) if output is not None}
+        # Stored under the backend that answered, a restarted inference server may run another one
+        backend = getattr(classifier, "backend", None)
+        cache.set_many({
+            classification_cache_key(model_name, text, backend): output
+            for text, output in zip(missing.values(), new_outputs) if output is not None
+        })
+        outputs.update(new_entries)
+    return [outputs.get(key) for key in keys]
+
 # Analyze each sentence with EmoRoBERTa
-def analyze_sentences(sentences):
+def analyze_sentences(sentences, batch_size=SENTIMENT_BATCH_SIZE, max_length=SENTIMENT_MAX_LENGTH):
+    texts = [sentence["text"] for sentence in sentences]
+    with model_registry.use("sentiment") as emo_roberta:
+        outputs = run_cached_inference(emo_roberta, texts, batch_size=batch_size, max_length=max_length)
+    return sentiment_results(sentences, outputs)
+
+# Sentence results from the sentiment classifier outputs (one per sentence, None if it failed)
+def sentiment_results(sentences, outputs):
     results = []
-    for i, sentence in enumerate(sentences, 1):
+    for i, (sentence, analysis) in enumerate(zip(sentences, outputs), 1):
         try:
-            analysis = emo_roberta(sentence["text"])[0]
             sentiment = label_map.get(analysis["label"], "Neutral")
         except:
             sentiment = "Neutral"
@@ -280,61 +1573,73 @@ def analyze_sentences(sentences):
         })
     return results
 
+# Pick the sentence shown at each second of the video (one sentence per second).
+# Same choice as scanning every sentence per second, but done as a single sweep:
+# the covering sentence with the lowest index wins, otherwise the nearest one.
+def assign_sentences_to_seconds(sentence_results):
+    total_duration = max(s["end_time"] for s in sentence_results)
+    by_start = sorted(range(len(sentence_results)), key=lambda i: (sentence_results[i]["start_time"], i))
+    by_end = sorted(range(len(sentence_results)), key=lambda i: (sentence_results[i]["end_time"], i))
+
+    def distance(i, t):
+        s = sentence_results[i]
+        return min(abs(t - s["start_time"]), abs(t - s["end_time"]))
+
+    assigned = []
+    active = []  # heap of indices of sentences that have started
+    next_start = 0
+    next_end = 0
+    last_ended = None  # ended sentence with the latest end time (lowest index on ties)
+    for t in range(int(total_duration) + 1):
+        while next_start < len(by_start) and sentence_results[by_start[next_start]]["start_time"] <= t:
+            heapq.heappush(active, by_start[next_start])
+            next_start += 1
+        while next_end < len(by_end) and sentence_results[by_end[next_end]]["end_time"] < t:
+            i = by_end[next_end]
+            if last_ended is None or sentence_results[i]["end_time"] > sentence_results[last_ended]["end_time"]:
+                last_ended = i
+            next_end += 1
+        # Drop sentences that already ended, the heap top is then the first covering sentence
+        while active and sentence_results[active[0]]["end_time"] < t:
+            heapq.heappop(active)
+
+        if active:
+            assigned.append(active[0])
+            continue
+
+        # No sentence contains this timestamp, use the nearest one before or after it
+        candidates = [i for i in (last_ended, by_start[next_start] if next_start < len(by_start) else None) if i is not None]
+        assigned.append(min(candidates, key=lambda i: (distance(i, t), i)))
+    return assigned
+
 # Apply smoothing to sentiment values over time
 def apply_smoothing(sentence_results, window_size=3):
     # Convert to sentiment values (1 for the assigned sentiment, 0 for others)
-    timeline_data = []
-    total_duration = max(s["end_time"] for s in sentence_results)
-    
-    # Create data points every second
-    for t in range(int(total_duration) + 1):
-        # Find the sentence that contains this timestamp
-        current_sentence = None
-        for s in sentence_results:
-            if s["start_time"] <= t and s["end_time"] >= t:
-                current_sentence = s
-                break
-        
-        # If no sentence contains this timestamp, use the nearest one
-        if not current_sentence and sentence_results:
-            # Find nearest sentence by distance to midpoint
-            current_sentence = min(
-                sentence_results,
-                key=lambda s: min(
-                    abs(t - s["start_time"]),
-                    abs(t - s["end_time"])
-                )
-            )
-        
-        # Add data point
-        if current_sentence:
-            sentiment = current_sentence["final_sentiment"]
-            data_point = {
-                "time": t,
-                "Positive": 1 if sentiment == "Positive" else 0,
-                "Negative": 1 if sentiment == "Negative" else 0,
-                "Neutral": 1 if sentiment == "Neutral" else 0
-            }
-            timeline_data.append(data_point)
-    
+    sentiments = ["Positive", "Negative", "Neutral"]
+    assigned = assign_sentences_to_seconds(sentence_results)
+    n = len(assigned)
+
+    # Prefix sums per sentiment so each window average is O(1)
+    prefix = {sentiment: [0] * (n + 1) for sentiment in sentiments}
+    for t, i in enumerate(assigned):
+        label = sentence_results[i]["final_sentiment"]
+        for sentiment in sentiments:
+            prefix[sentiment][t + 1] = prefix[sentiment][t] + (1 if label == sentiment else 0)
+
     # Apply smoothing
     smoothed_data = []
-    for i, point in enumerate(timeline_data):
+    for t in range(n):
         # Calculate window boundaries
-        window_start = max(0, i - window_size // 2)
-        window_end = min(len(timeline_data), i + window_size // 2 + 1)
-        window = timeline_data[window_start:window_end]
+        window_start = max(0, t - window_size // 2)
+        window_end = min(n, t + window_size // 2 + 1)
+        window_len = window_end - window_start
         
         # Calculate moving averages
-        positive_avg = sum(p["Positive"] for p in window) / len(window)
-        negative_avg = sum(p["Negative"] for p in window) / len(window)
-        neutral_avg = sum(p["Neutral"] for p in window) / len(window)
-        
         smoothed_data.append({
-            "time": point["time"],
-            "Positive": positive_avg,
-            "Negative": negative_avg,
-            "Neutral": neutral_avg
+            "time": t,
+            "Positive": (prefix["Positive"][window_end] - prefix["Positive"][window_start]) / window_len,
+            "Negative": (prefix["Negative"][window_end] - prefix["Negative"][window_start]) / window_len,
+            "Neutral": (prefix["Neutral"][window_end] - prefix["Neutral"][window_start]) / window_len
         })
     
     return smoothed_data
@@ -352,26 +1657,86 @@ def summarize_results(sentences):
     overall = max(counts, key=counts.get)
     return summary, overall
 
-# Main endpoint to analyze video
-@app.post("/analyze")
-async def analyze(req: AnalyzeRequest):
-    # Check if analysis already exists
-    existing = check_existing_analysis_by_video(req.url)
-    if existing:
-        return existing
+# ------ IN-FLIGHT LEASES -------
 
-    # Create a progress entry
-    doc_id = generate_doc_id(req.url)
-    update_progress(req.url, req.user_id, "starting", 5, "Starting analysis...")
+# Seconds a lease survives without a heartbeat (covers crashed workers)
+ANALYSIS_LEASE_TTL = float(os.getenv("ANALYSIS_LEASE_TTL", "300"))
+# Identifies this uvicorn worker process in lease documents
+PROCESS_ID = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+class AnalysisLease:
+    """Cross-process lock on one video, stored in analysis_leases next to analysis_progress."""
+
+    def __init__(self, doc_id, job_id, ttl=ANALYSIS_LEASE_TTL):
+        self.doc_id = doc_id
+        self.job_id = job_id
+        self.ttl = ttl
+        self.holder = None
+        self._stop_heartbeat = None
+
+    @property
+    def held(self):
+        return self.holder is not None and self.holder.get("job_id") == self.job_id
+
+    def acquire(self):
+        # Returns the current holder, which is this job when the lease was free or expired
+        self.holder = get_storage().acquire_lease(self.doc_id, self.job_id, self.ttl)
+        return self.holder
+
+    # Acquire again right before the job runs: False when the lease expired anyway and
+    # another worker process took it (and is running the analysis)
+    def confirm(self):
+        self.acquire()
+        return self.held
+
+    def renew(self):
+        if self.held:
+            get_storage().renew_lease(self.doc_id, self.job_id, self.ttl)
+
+    # Renew in the background from acquisition until release, so the lease does not
+    # expire while the job is still waiting in the queue
+    def start_heartbeat(self):
+        if self.held and self._stop_heartbeat is None:
+            self._stop_heartbeat = threading.Event()
+            threading.Thread(target=self.keep_alive, args=(self._stop_heartbeat,), daemon=True).start()
+
+    def release(self):
+        if self._stop_heartbeat is not None:
+            self._stop_heartbeat.set()
+            self._stop_heartbeat = None
+        if self.held:
+            get_storage().release_lease(self.doc_id, self.job_id)
+            self.holder = None
 
+    def keep_alive(self, stop_event):
+        while not stop_event.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except Exception as e:
+                print(f"Lease renewal failed for {self.doc_id}: {e}")
+
+# Run the full analysis pipeline for one video (called from the job workers)
+def run_analysis(req, job=None):
+    job_id = job.id if job else None
+
+    def progress(status, percent, message):
+        # Stop between stages if the job was cancelled
+        if job:
+            job.check_cancelled()
+        update_progress(req.url, req.user_id, status, percent, message, job_id=job_id)
+
+    audio_file = None
     try:
+        progress("starting", 5, "Starting analysis...")
+
         # 1. Download audio
-        update_progress(req.url, req.user_id, "downloading", 10, "Downloading audio from YouTube...")
-        audio_file = download_youtube_audio(req.url)
-        update_progress(req.url, req.user_id, "downloaded", 20, "Audio downloaded successfully!")
+        progress("downloading", 10, "Downloading audio from YouTube...")
+        with stage_seconds.time(stage="download"):
+            audio_file = fetch_audio(req.url)
+        progress("downloaded", 20, "Audio downloaded successfully!")
         
         # 2. Transcribe audio (now with translation for Hebrew/Arabic)
-        update_progress(req.url, req.user_id, "transcribing", 30, "Converting speech to text...")
+        progress("transcribing", 30, "Converting speech to text...")
         whisper_response = transcribe_audio(audio_file)
         
         # Get the transcribed text
@@ -395,41 +1760,64 @@ async def analyze(req: AnalyzeRequest):
         # Save partial result with just transcription
         if has_translation:
             save_analysis(
-                req.user_id, req.url, whisper_response, [], {}, "", [], "transcribed"
+                req.user_id, req.url, whisper_response, [], {}, "", [], "transcribed", background=True
             )
         else:
             save_analysis(
-                req.user_id, req.url, text, [], {}, "", [], "transcribed"
+                req.user_id, req.url, text, [], {}, "", [], "transcribed", background=True
             )
         
-        update_progress(req.url, req.user_id, "transcribed", 50, "Speech successfully converted to text!")
+        progress("transcribed", 50, "Speech successfully converted to text!")
         
-        # 3. Analyze sentences
-        update_progress(req.url, req.user_id, "analyzing", 60, "Analyzing emotional content...")
-        analysis = analyze_sentences(sentences)
+        # 3. Analyze sentences (and complex emotions in the same pass when requested)
+        advanced = None
+        with_advanced = job.advanced_requested() if job else req.advanced
+        if with_advanced:
+            progress("analyzing", 60, "Analyzing emotional content and complex emotions...")
+            with stage_seconds.time(stage="classify"):
+                analysis, advanced_results = analyze_sentences_and_emotions(sentences)
+        else:
+            progress("analyzing", 60, "Analyzing emotional content...")
+            with stage_seconds.time(stage="classify"):
+                analysis = analyze_sentences(sentences)
         
         # 4. Create timeline
-        update_progress(req.url, req.user_id, "creating_timeline", 80, "Building sentiment timeline...")
-        timeline_data = apply_smoothing(analysis)
+        progress("creating_timeline", 80, "Building sentiment timeline...")
+        with stage_seconds.time(stage="timeline"):
+            timeline_data = apply_smoothing(analysis)
+            if with_advanced:
+                emotion_timeline = create_emotion_timeline(advanced_results)
         
         # 5. Summarize results
-        update_progress(req.url, req.user_id, "summarizing", 90, "Creating emotional summary...")
-        summary, overall = summarize_results(analysis)
+        progress("summarizing", 90, "Creating emotional summary...")
+        with stage_seconds.time(stage="summarize"):
+            summary, overall = summarize_results(analysis)
+            if with_advanced:
+                advanced = {
+                    "sentence_emotions": advanced_results,
+                    "emotion_timeline": emotion_timeline,
+                    "emotion_summary": summarize_emotions(advanced_results)
+                }
         
-        # Save complete analysis
-        if has_translation:
-            save_analysis(
-                req.user_id, req.url, whisper_response, analysis, summary, overall, timeline_data
-            )
-        else:
-            save_analysis(
-                req.user_id, req.url, text, analysis, summary, overall, timeline_data
-            )
-        
-        update_progress(req.url, req.user_id, "complete", 100, "Analysis complete!")
+        # Save complete analysis (and the advanced analysis in the same write)
+        with stage_seconds.time(stage="persist"):
+            if has_translation:
+                save_analysis(
+                    req.user_id, req.url, whisper_response, analysis, summary, overall, timeline_data, advanced=advanced
+                )
+            else:
+                save_analysis(
+                    req.user_id, req.url, text, analysis, summary, overall, timeline_data, advanced=advanced
+                )
         
-        # Clean up
-        os.remove(audio_file)
+        update_progress(req.url, req.user_id, "complete", 100, "Analysis complete!", job_id=job_id)
+
+        # An advanced request attached after the classify stage, run it on the saved sentences
+        if job and job.advanced_requested(final=True) and not with_advanced:
+            try:
+                advanced_jobs.submit(req, key=generate_doc_id(req.url))
+            except QueueFull as e:
+                print(f"Could not queue the advanced analysis for {req.url}: {e}")
 
         # Create response data
         response_data = {
@@ -446,144 +1834,663 @@ async def analyze(req: AnalyzeRequest):
         # Add translation info if available
         if translation_info:
             response_data.update(translation_info)
+        if advanced:
+            response_data.update(advanced)
             
         return response_data
+    except JobCancelled:
+        update_progress(req.url, req.user_id, "cancelled", 0, "Analysis cancelled", job_id=job_id)
+        raise
+    except Exception as e:
+        update_progress(req.url, req.user_id, "error", 0, f"Error: {str(e)}", job_id=job_id)
+        raise
+    finally:
+        # Clean up (cached audio stays for the next request, it only stops being in use)
+        if audio_file and get_media_cache().owns(audio_file):
+            get_media_cache().release_audio(audio_file)
+        elif audio_file and os.path.exists(audio_file):
+            os.remove(audio_file)
+
+
+# ------ BACKGROUND JOB QUEUE -------
+
+# Number of analyses that run at the same time
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "2"))
+# Maximum number of analyses waiting for a free worker
+ANALYSIS_QUEUE_SIZE = int(os.getenv("ANALYSIS_QUEUE_SIZE", "20"))
+# How many finished jobs to remember for /jobs lookups
+ANALYSIS_JOB_HISTORY = int(os.getenv("ANALYSIS_JOB_HISTORY", "200"))
+# Advanced emotion analyses that run at the same time (each holds the GoEmotions model)
+ADVANCED_ANALYSIS_WORKERS = int(os.getenv("ADVANCED_ANALYSIS_WORKERS", "1"))
+
+class JobCancelled(Exception):
+    pass
+
+class QueueFull(Exception):
+    pass
+
+class AnalysisJob:
+    def __init__(self, req, key=None, job_id=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.req = req
+        self.key = key
+        self.lease = None
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.done_event = threading.Event()
+        # Also run the advanced analysis, set by requests that attach with advanced=true
+        self.advanced = req.advanced
+        self._advanced_lock = threading.Lock()
+        self._advanced_closed = False
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    # Upgrade the job to an advanced analysis, False once it has saved its results and
+    # no longer looks at the flag
+    def request_advanced(self):
+        with self._advanced_lock:
+            if self._advanced_closed:
+                return False
+            self.advanced = True
+            return True
+
+    # Read the flag, final=True stops later upgrades
+    def advanced_requested(self, final=False):
+        with self._advanced_lock:
+            self._advanced_closed = self._advanced_closed or final
+            return self.advanced
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "video_url": self.req.url,
+            "user_id": self.req.user_id,
+            "status": self.status,
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class AnalysisJobQueue:
+    """Bounded queue of analysis jobs served by a fixed pool of worker threads."""
+
+    def __init__(self, handler, on_queued=None, on_rejected=None, workers=ANALYSIS_WORKERS, max_queue=ANALYSIS_QUEUE_SIZE, history=ANALYSIS_JOB_HISTORY):
+        self.handler = handler
+        self.on_queued = on_queued
+        # Called when a job announced by on_queued could not be queued after all
+        self.on_rejected = on_rejected
+        self.workers = workers
+        self.max_queue = max_queue
+        self.history = history
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = 0
+
+    def _ensure_workers(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"analysis-worker-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def submit(self, req, key=None, job_id=None, lease=None):
+        self._ensure_workers()
+        job = AnalysisJob(req, key=key, job_id=job_id)
+        job.lease = lease
+        with self._lock:
+            # Single flight: a second request for the same key attaches to the running job,
+            # even when the queue is full
+            active = self._active.get(key) if key else None
+            if active is not None:
+                return active, False
+            if self._queue.full():
+                raise QueueFull(f"Analysis queue is full ({self.max_queue} jobs waiting)")
+            if key:
+                self._active[key] = job
+            self._jobs[job.id] = job
+            self._prune()
+        # Runs before the job is visible to workers so it cannot overwrite their first update
+        if self.on_queued:
+            self.on_queued(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            job.status = "error"
+            job.error = "Analysis queue is full"
+            self._finish(job)
+            if self.on_rejected:
+                self.on_rejected(job)
+            raise QueueFull(f"Analysis queue is full ({self.max_queue} jobs waiting)")
+        return job, True
+
+    def find(self, key):
+        return self._active.get(key)
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.done_event.is_set():
+            return False
+        job.cancel_event.set()
+        return True
+
+    def stats(self):
+        with self._lock:
+            statuses = Counter(job.status for job in self._jobs.values())
+            return {
+                "workers": self.workers,
+                "running": self._running,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "jobs": dict(statuses),
+            }
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.done_event.is_set()]
+        finished.sort(key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        # Jobs cancelled while waiting still go through the handler, which stops at its first checkpoint
+        with self._lock:
+            self._running += 1
+        job.status = "running"
+        job.started_at = time.time()
+        queue_wait_seconds.observe(job.started_at - job.submitted_at)
+        try:
+            job.result = self.handler(job)
+            job.status = "complete"
+        except JobCancelled:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "error"
+            job.error = str(e)
+        finally:
+            with self._lock:
+                self._running -= 1
+            jobs_finished.inc(status=job.status)
+            self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            if job.key and self._active.get(job.key) is job:
+                del self._active[job.key]
+        job.finished_at = time.time()
+        job.done_event.set()
+
+# The job's lease is renewed from /analyze on and released when the job ends
+def run_analysis_job(job):
+    try:
+        if job.lease and not job.lease.confirm():
+            # Another worker process owns the analysis (and its progress) now, do not run it twice
+            job.error = f"Analysis taken over by job {job.lease.holder.get('job_id')}"
+            print(f"{job.error} ({job.req.url})")
+            raise JobCancelled(job.id)
+        return run_analysis(job.req, job)
+    finally:
+        if job.lease:
+            job.lease.release()
+
+analysis_jobs = AnalysisJobQueue(
+    run_analysis_job,
+    on_queued=lambda job: update_progress(job.req.url, job.req.user_id, "queued", 0, "Waiting for a free worker...", job_id=job.id),
+    on_rejected=lambda job: update_progress(job.req.url, job.req.user_id, "error", 0, f"Error: {job.error}", job_id=job.id),
+)
+
+# Main endpoint to analyze video
+# Plain def: FastAPI runs it on its thread pool, the storage reads and the lease
+# transaction below must not block the event loop
+@app.post("/analyze")
+def analyze(req: AnalyzeRequest):
+    # Check if analysis already exists. A partial ("transcribed") document belongs to a job
+    # that is still running, or that died, and is handled below like no document at all
+    existing = check_existing_analysis_by_video(req.url)
+    if existing and existing.get("status", "complete") == "complete":
+        existing["timeline_data"] = format_timeline(existing.get("timeline_data", []))
+        # Include a stored advanced analysis, otherwise it is still available from /analyze/advanced-emotions
+        advanced = read_document("advanced_analyses", generate_doc_id(req.url)) if req.advanced else None
+        if advanced:
+            existing.update({field: advanced.get(field) for field in ("sentence_emotions", "emotion_summary")})
+            existing["emotion_timeline"] = format_timeline(advanced.get("emotion_timeline", []))
+        return existing
+
+    # Attach to an analysis of the same video that is already running in this process
+    doc_id = generate_doc_id(req.url)
+    job = analysis_jobs.find(doc_id)
+    if job:
+        # advanced=true upgrades the running job, or queues the advanced analysis itself
+        # when the job has already saved its results
+        if req.advanced and not job.request_advanced():
+            try:
+                advanced_jobs.submit(req, key=doc_id)
+            except QueueFull as e:
+                raise HTTPException(status_code=503, detail=str(e))
+        return analysis_job_response(job.id, req, job.status, attached=True)
+
+    # Or in another worker process, found through its lease. That worker does not see this
+    # request, so advanced=true is not passed on (the response says "advanced": false)
+    lease = AnalysisLease(doc_id, str(uuid.uuid4()))
+    holder = lease.acquire()
+    if not lease.held:
+        return analysis_job_response(holder.get("job_id"), req, "running", attached=True, advanced=False)
+    lease.start_heartbeat()
+
+    # Queue the analysis and return right away, progress is tracked in analysis_progress
+    try:
+        job, created = analysis_jobs.submit(req, key=doc_id, job_id=lease.job_id, lease=lease)
+    except QueueFull as e:
+        lease.release()
+        raise HTTPException(status_code=503, detail=str(e))
+    if not created:
+        lease.release()
+
+    return analysis_job_response(job.id, req, job.status, attached=not created)
+
+# /jobs/{job_id} only knows the jobs of the worker process that answers it, so a job_id
+# attached through another worker's lease is not found there. progress_url works from any
+# worker (it reads analysis_progress) and is what clients should follow.
+# "advanced" is false when the advanced analysis will not run with this job, clients then
+# call /analyze/advanced-emotions once it is complete
+def analysis_job_response(job_id, req, status, attached=False, advanced=None):
+    return {
+        "job_id": job_id,
+        "user_id": req.user_id,
+        "video_url": req.url,
+        "status": status,
+        "attached": attached,
+        "advanced": req.advanced if advanced is None else advanced,
+        "progress_url": f"/progress/stream/{quote(req.url, safe='')}",
+        "queue_depth": analysis_jobs.stats()["queue_depth"]
+    }
+
+# Liveness, answers as soon as the process is up
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+# Readiness: storage is connected and, when warming up on startup, every PRELOAD_MODELS
+# model is loaded (without warm-up models load on first use and are not waited for).
+# With INFERENCE_SERVER_URL the models live in the inference server, so its /ready is asked instead.
+@app.get("/ready")
+async def ready():
+    error = startup_state["error"]
+    if storage is None:
+        try:
+            await asyncio.to_thread(get_storage)
+        except Exception as e:
+            error = str(e)
+    models = model_registry.status()
+    if INFERENCE_SERVER_URL:
+        models_ready = await asyncio.to_thread(inference_server_status) is not None
+    else:
+        required = PRELOAD_MODELS if WARM_UP_ON_STARTUP else []
+        models_ready = all(models.get(name) == "warm" for name in required)
+    is_ready = storage is not None and models_ready
+    body = {
+        "ready": is_ready,
+        "storage": STORAGE_BACKEND if storage is not None else None,
+        "models": models,
+        "error": error,
+    }
+    if INFERENCE_SERVER_URL:
+        body["inference_server"] = models_ready
+    return JSONResponse(body, status_code=200 if is_ready else 503)
+
+# Queue depth and worker usage
+@app.get("/jobs")
+async def get_jobs():
+    return analysis_jobs.stats()
+
+# Hit/miss counters of the in-process and local caches
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return {
+        "results": results_cache.stats(),
+        "media": get_media_cache().stats(),
+        "translations": get_translation_cache().stats(),
+        "classifications": get_classification_cache().stats()
+    }
+
+# Cache hit/miss counts and job queue state, read from the components on every scrape
+@metrics.collector
+def collect_runtime_metrics():
+    caches = {"results": results_cache.stats()}
+    if translation_cache is not None:
+        caches["translations"] = translation_cache.stats()
+    if classification_cache is not None:
+        caches["classifications"] = classification_cache.stats()
+    if media_cache is not None:
+        media = media_cache.stats()
+        for kind in ("audio", "transcript"):
+            caches[f"media_{kind}"] = {"hits": media["hits"].get(kind, 0), "misses": media["misses"].get(kind, 0)}
+    jobs = analysis_jobs.stats()
+    return [
+        ("arcscan_cache_hits_total", "counter", "Cache lookups that were served from the cache",
+         [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("arcscan_cache_misses_total", "counter", "Cache lookups that missed",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("arcscan_queue_depth", "gauge", "Analysis jobs waiting for a worker", [({}, jobs["queue_depth"])]),
+        ("arcscan_jobs_running", "gauge", "Analysis jobs being processed", [({}, jobs["running"])]),
+        ("arcscan_model_loaded", "gauge", "1 when the model is loaded in this process",
+         [({"model": name}, int(state == "warm")) for name, state in model_registry.status().items()]),
+    ]
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Status of a single analysis job
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = analysis_jobs.get(job_id)
+    if job is None:
+        # Jobs running in another worker process are only visible through /progress/stream
+        raise HTTPException(status_code=404, detail="Job not found in this worker, follow progress_url instead")
+    return job.to_dict()
+
+# Cancel a queued or running analysis job
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    if not analysis_jobs.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found or already finished")
+    return {"job_id": job_id, "status": "cancelling"}
+
+# Seconds between Firestore checks while streaming, for jobs running in another process
+PROGRESS_STREAM_POLL_SECONDS = float(os.getenv("PROGRESS_STREAM_POLL_SECONDS", "5"))
+# Seconds between keep-alive comments on an idle stream
+PROGRESS_STREAM_HEARTBEAT_SECONDS = 15
+
+def read_progress(doc_id):
+    latest = progress_broker.latest(doc_id)
+    if latest:
+        return latest
+    return get_storage().get_document("analysis_progress", doc_id)
+
+def format_sse(event):
+    return f"data: {json.dumps(event, default=str)}\n\n"
+
+# Add this endpoint to check advanced analysis progress.
+# The advanced routes are registered before /progress/{video_url:path} and
+# /results/{video_url:path} so those routes do not swallow them.
+@app.get("/progress/advanced/{video_url:path}")
+async def get_advanced_progress(video_url: str):
+    try:
+        from urllib.parse import unquote
+        decoded_url = unquote(video_url)
+        doc_id = generate_doc_id(decoded_url)
+        
+        # First check if analysis exists
+        if read_document("advanced_analyses", doc_id) is not None:
+            return {"status": "complete", "progress": 100}
+        
+        # Check progress
+        progress_data = get_storage().get_document("analysis_progress", doc_id)
+        
+        if progress_data:
+            # Only return if it's advanced progress
+            if progress_data.get("status", "") in ADVANCED_PROGRESS_STATUSES:
+                return progress_data
+            
+        return {"status": "not_started", "progress": 0}
     except Exception as e:
-        update_progress(req.url, req.user_id, "error", 0, f"Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        return {"status": "error", "progress": 0, "message": str(e)}
+
+
+# Add this endpoint to get advanced results
+@app.get("/results/advanced/{video_url:path}")
+async def get_advanced_results(video_url: str, timeline_format: str = "rows", points: Optional[int] = None):
+    check_timeline_format(timeline_format)
+    doc_id = generate_doc_id(video_url)
+    advanced = read_document("advanced_analyses", doc_id)
+    if advanced is not None:
+        advanced["emotion_timeline"] = format_timeline(advanced.get("emotion_timeline", []), timeline_format, points)
+        return advanced
+    
+    raise HTTPException(status_code=404, detail="Advanced analysis not found")
+
+# Stream progress updates as server-sent events until the analysis ends.
+# Registered before /progress/{video_url:path} so that route does not swallow it.
+@app.get("/progress/stream/{video_url:path}")
+async def stream_progress(video_url: str, request: Request):
+    from urllib.parse import unquote
+    doc_id = generate_doc_id(unquote(video_url))
+
+    async def events():
+        subscriber = progress_broker.subscribe(doc_id)
+        try:
+            # Current state first, Firestore is the fallback for clients that reconnect
+            current = await asyncio.to_thread(read_progress, doc_id) or {"status": "not_started", "progress": 0}
+            yield format_sse(current)
+            last_sent = time.monotonic()
+            while current.get("status") not in TERMINAL_PROGRESS_STATUSES:
+                if await request.is_disconnected():
+                    return
+                try:
+                    current = await asyncio.wait_for(subscriber[1].get(), timeout=PROGRESS_STREAM_POLL_SECONDS)
+                    last_sent = time.monotonic()
+                    yield format_sse(current)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+                if progress_broker.latest(doc_id) is None:
+                    # Nothing running here, the job may live in another worker process
+                    stored = await asyncio.to_thread(read_progress, doc_id)
+                    if stored and (stored.get("status"), stored.get("progress")) != (current.get("status"), current.get("progress")):
+                        current = stored
+                        last_sent = time.monotonic()
+                        yield format_sse(current)
+                        continue
+                if time.monotonic() - last_sent >= PROGRESS_STREAM_HEARTBEAT_SECONDS:
+                    last_sent = time.monotonic()
+                    yield ": keep-alive\n\n"
+        finally:
+            progress_broker.unsubscribe(doc_id, subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 # Get analysis progress - FIXED to handle full URLs
 @app.get("/progress/{video_url:path}")
 async def get_progress(video_url: str):
     try:
         from urllib.parse import unquote
         decoded_url = unquote(video_url)
-        print(f"Getting progress for URL: {decoded_url}")  # Add debug logging
-        
         doc_id = generate_doc_id(decoded_url)
-        print(f"Generated doc_id: {doc_id}")  # Add debug logging
-        
-        doc_ref = db.collection("analysis_progress").document(doc_id).get()
-        
-        if doc_ref.exists:
-            progress_data = doc_ref.to_dict()
-            print(f"Progress found: {progress_data}")  # Add debug logging
+
+        # Progress of jobs running in this process is served from memory
+        progress_data = read_progress(doc_id)
+        if progress_data:
             return progress_data
-        else:
-            print("No progress found, returning not_started")  # Add debug logging
-            return {"status": "not_started", "progress": 0}
+        return {"status": "not_started", "progress": 0}
     except Exception as e:
         print(f"Error getting progress: {e}")
         return {"status": "error", "progress": 0, "message": str(e)}
     
-# Get all analyses done by a specific user
+# Fields returned for each history entry unless it is expanded
+HISTORY_SUMMARY_FIELDS = ["video_url", "status", "overall_sentiment", "summary", "created_at"]
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Get analyses done by a specific user, newest first, one page at a time.
+# `cursor` is the id of the last entry of the previous page, `expand` a comma separated
+# list of entry ids to return in full.
 @app.get("/history/{user_id}")
-async def get_user_history(user_id: str):
-    results = []
-    docs = db.collection("analyses").where("user_id", "==", user_id).stream()
-    for doc in docs:
-        results.append(doc.to_dict())
-    return results
+async def get_user_history(user_id: str, limit: int = 20, cursor: Optional[str] = None, expand: Optional[str] = None):
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+    try:
+        docs, next_cursor = get_storage().list_history(user_id, HISTORY_SUMMARY_FIELDS, limit, cursor)
+    except KeyError:
+        raise HTTPException(status_code=400, detail="Invalid history cursor")
+    except MissingIndex as e:
+        print(f"History query failed: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+
+    expanded_ids = {doc_id for doc_id in (expand or "").split(",") if doc_id}
+    items = []
+    for doc_id, summary in docs:
+        if doc_id in expanded_ids:
+            full = read_document("analyses", doc_id) or {}
+            full["timeline_data"] = format_timeline(full.get("timeline_data", []))
+            items.append({"id": doc_id, **full})
+        else:
+            items.append({"id": doc_id, **summary})
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor
+    }
+
+# Part of a timeline, e.g. minute 30 to 40 is start=1800&end=2400.
+# Registered before /results/{video_url:path} so that route does not swallow it.
+@app.get("/results/timeline/{video_url:path}")
+async def get_timeline_range(video_url: str, start: float = 0, end: Optional[float] = None, advanced: bool = False, timeline_format: str = "rows", points: Optional[int] = None):
+    check_timeline_format(timeline_format)
+    collection, field = ("advanced_analyses", "emotion_timeline") if advanced else ("analyses", "timeline_data")
+    rows = get_storage().read_timeline_range(collection, generate_doc_id(video_url), field, start, float("inf") if end is None else end)
+    if rows is None:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    return {"start": start, "end": end, field: format_timeline(rows, timeline_format, points)}
 
 @app.get("/results/{video_url:path}")
-async def get_results(video_url: str):
+async def get_results(video_url: str, timeline_format: str = "rows", points: Optional[int] = None):
+    check_timeline_format(timeline_format)
     existing = check_existing_analysis_by_video(video_url)
     if existing:
+        existing["timeline_data"] = format_timeline(existing.get("timeline_data", []), timeline_format, points)
         return existing
     raise HTTPException(status_code=404, detail="Analysis not found")
 
 
 # ------ ADVANCED EMOTIONS ANALYSIS - NEW CODE STARTS HERE -------
 
+# Sentences long enough for the emotion classifier
+def emotion_sentences(sentences):
+    return [sentence for sentence in sentences if len(sentence["text"].split()) >= 3]
+
 #Function to analyze complex emotions using GoEmotions model
 def analyze_advanced_emotions(sentences):
-    # Initialize the model only when needed (to save memory)
-    emotion_classifier = transformers_pipeline(
-        "text-classification",
-        model="monologg/bert-base-cased-goemotions-original",
-        return_all_scores=True
-    )
+    sentences = emotion_sentences(sentences)
+    texts = [sentence["text"] for sentence in sentences]
+    # Shared per-process classifier, loaded on first use and unloaded when idle
+    with model_registry.use("goemotions") as emotion_classifier:
+        outputs = run_cached_inference(
+            emotion_classifier, texts, batch_size=SENTIMENT_BATCH_SIZE, max_length=SENTIMENT_MAX_LENGTH, model_name="goemotions"
+        )
+    return emotion_results(sentences, outputs)
+
+# Top-3 emotions per sentence from the GoEmotions outputs, failed sentences are skipped
+def emotion_results(sentences, outputs):
     results = []
-    for sentence in sentences:
-        text = sentence["text"]
-        if len(text.split()) < 3:
-            continue
-        try:
-            emotion_scores = emotion_classifier(text)[0]
-            emotions_dict = {item['label']: item['score'] for item in emotion_scores}
-            top_emotions = sorted(emotions_dict.items(), key=lambda x: x[1], reverse=True)[:3]
-            formatted_emotions = [
-                {"emotion": emotion, "score": round(score * 100, 1)}
-                for emotion, score in top_emotions if score > 0.1
-            ]
-            results.append({
-                "text": text,
-                "start_time": sentence["start_time"],
-                "end_time": sentence["end_time"],
-                "emotions": formatted_emotions
-            })
-        except Exception as e:
-            print(f"Error analyzing advanced emotions: {e}")
+    for sentence, emotion_scores in zip(sentences, outputs):
+        if emotion_scores is None:
+            print(f"Error analyzing advanced emotions: {sentence['text'][:50]}")
             continue
+        emotions_dict = {item['label']: item['score'] for item in emotion_scores}
+        top_emotions = sorted(emotions_dict.items(), key=lambda x: x[1], reverse=True)[:3]
+        formatted_emotions = [
+            {"emotion": emotion, "score": round(score * 100, 1)}
+            for emotion, score in top_emotions if score > 0.1
+        ]
+        results.append({
+            "text": sentence["text"],
+            "start_time": sentence["start_time"],
+            "end_time": sentence["end_time"],
+            "emotions": formatted_emotions
+        })
     return results
 
-# Create an emotion timeline for visualization
-def create_emotion_timeline(results, window_size=5):
+# Sentiment and GoEmotions over the same sentences in one pass (/analyze with advanced=true).
+# Texts are extracted and filtered once and both models stay loaded for the whole pass;
+# tokenization itself is per model since RoBERTa and BERT use different vocabularies.
+def analyze_sentences_and_emotions(sentences, batch_size=SENTIMENT_BATCH_SIZE, max_length=SENTIMENT_MAX_LENGTH):
+    eligible = emotion_sentences(sentences)
+    with model_registry.use("sentiment") as emo_roberta, model_registry.use("goemotions") as emotion_classifier:
+        sentiment_outputs = run_cached_inference(
+            emo_roberta, [sentence["text"] for sentence in sentences], batch_size=batch_size, max_length=max_length
+        )
+        emotion_outputs = run_cached_inference(
+            emotion_classifier, [sentence["text"] for sentence in eligible], batch_size=batch_size, max_length=max_length, model_name="goemotions"
+        )
+    # Same fields the advanced endpoint builds from the stored sentences
+    return sentiment_results(sentences, sentiment_outputs), emotion_results(eligible, emotion_outputs)
+
+# Build the emotion timeline as a seconds x emotions float32 matrix
+def build_emotion_matrix(results, window_size=5):
     # First, identify which emotions are actually present in the data
     detected_emotions = set()
     for result in results:
         for emotion_data in result["emotions"]:
             detected_emotions.add(emotion_data["emotion"])
     
-    # Use detected emotions plus core emotions
-    tracked_emotions = list(detected_emotions.union(set(CORE_EMOTIONS)))
-    
-    # Initialize timeline
-    timeline = []
-    
-    # Get total duration of video
+    # Use core emotions plus any other detected emotions
+    tracked_emotions = CORE_EMOTIONS + sorted(detected_emotions - set(CORE_EMOTIONS))
+    column = {emotion: j for j, emotion in enumerate(tracked_emotions)}
+
     if not results:
-        return []
+        return tracked_emotions, np.zeros((0, len(tracked_emotions)), dtype=np.float32)
+
+    # Get total duration of video
     total_duration = max(r["end_time"] for r in results)
-    
-    # Create initial data structure with time points
-    for t in range(int(total_duration) + 1):
-        data_point = {"time": t}
-        for emotion in tracked_emotions:
-            data_point[emotion] = 0
-        timeline.append(data_point)
-    
-    # Fill in emotion values for each second
+    n = int(total_duration) + 1
+
+    # Difference array: add the score at the first second, remove it after the last one
+    rows, ends, cols, scores = [], [], [], []
     for result in results:
-        start = int(result["start_time"])
-        end = int(result["end_time"])
-        
+        start, end = int(result["start_time"]), int(result["end_time"])
+        # A segment that ends before it starts covers no second
+        if end < start:
+            continue
         for emotion_data in result["emotions"]:
-            emotion = emotion_data["emotion"]
-            score = emotion_data["score"] / 100  # Convert percentage back to 0-1 scale
-            
-            # Apply score to each second in the time range
-            for t in range(start, end + 1):
-                if t < len(timeline):
-                    timeline[t][emotion] += score
-    
-    # Apply smoothing
-    smoothed_timeline = []
-    for i in range(len(timeline)):
-        window_start = max(0, i - window_size // 2)
-        window_end = min(len(timeline), i + window_size // 2 + 1)
-        window = timeline[window_start:window_end]
-        
-        smoothed_point = {"time": timeline[i]["time"]}
-        for emotion in tracked_emotions:
-            values = [point.get(emotion, 0) for point in window]
-            if values:
-                smoothed_point[emotion] = sum(values) / len(values)
-            else:
-                smoothed_point[emotion] = 0
-                
-        smoothed_timeline.append(smoothed_point)
-    
-    return smoothed_timeline
+            rows.append(start)
+            ends.append(min(end + 1, n))
+            cols.append(column[emotion_data["emotion"]])
+            scores.append(emotion_data["score"] / 100)  # Convert percentage back to 0-1 scale
+    diff = np.zeros((n + 1, len(tracked_emotions)), dtype=np.float64)
+    np.add.at(diff, (rows, cols), scores)
+    np.add.at(diff, (ends, cols), np.negative(scores))
+    timeline = np.cumsum(diff[:n], axis=0)
+
+    # Apply smoothing: centered moving average, the window shrinks at the edges
+    half = window_size // 2
+    padded = np.pad(timeline, ((half, half), (0, 0)))
+    window_sums = sum(padded[k:k + n] for k in range(2 * half + 1))
+    positions = np.arange(n)
+    counts = np.minimum(n, positions + half + 1) - np.maximum(0, positions - half)
+    smoothed = window_sums / counts[:, None]
+
+    return tracked_emotions, smoothed.astype(np.float32)
+
+# Convert the emotion matrix to the per-second JSON shape used by the API
+def emotion_matrix_to_rows(tracked_emotions, matrix):
+    values = matrix.astype(np.float64).round(6).tolist()
+    return [{"time": t, **dict(zip(tracked_emotions, row))} for t, row in enumerate(values)]
+
+# Create an emotion timeline for visualization
+def create_emotion_timeline(results, window_size=5):
+    tracked_emotions, matrix = build_emotion_matrix(results, window_size)
+    return emotion_matrix_to_rows(tracked_emotions, matrix)
 
 # Summarize emotions across the video
 def summarize_emotions(results):
@@ -629,74 +2536,51 @@ def summarize_emotions(results):
     return summary
 
 # Add a new endpoint for complex emotions
-@app.post("/analyze/advanced-emotions")
-async def analyze_advanced(req: AnalyzeRequest):
-    # First check if basic analysis exists
+# Advanced emotion analysis of a stored basic analysis, run on the advanced_jobs workers
+def run_advanced_analysis(req):
     doc_id = generate_doc_id(req.url)
-    doc_ref = db.collection("analyses").document(doc_id).get()
-    if not doc_ref.exists:
-        raise HTTPException(status_code=404, detail="Basic analysis not found. Run basic analysis first.")
-    
-    basic_analysis = doc_ref.to_dict()
-
-    # Check if advanced analysis already exists
-    advanced_ref = db.collection("advanced_analyses").document(doc_id).get()
-    if advanced_ref.exists:
-        return advanced_ref.to_dict()
-
+    basic_analysis = read_document("analyses", doc_id) or {}
     try:
+        # Never store an advanced analysis built from a missing or partial basic analysis
+        if basic_analysis.get("status", "complete") != "complete" or not basic_analysis:
+            raise ValueError("Basic analysis is not complete")
+
         # Get sentences from basic analysis
         sentences = basic_analysis.get("sentences", [])
         
-        # Check if we should use translated text
-        use_translated = req.translated and "translated_text" in basic_analysis
-        
-        # Extract just the text and timing info for processing
-        if use_translated:
-            # For non-English videos, use the translated text for analysis
-            sentence_data = []
-            for s in sentences:
-                # Get translated text if available, otherwise use original
-                text_to_use = basic_analysis.get("translated_text", basic_analysis.get("transcription", ""))
-                
-                # Since the translated text is a single block, use the original text
-                # just for timing information
-                sentence_data.append({
-                    "text": text_to_use,
-                    "start_time": s["start_time"], 
-                    "end_time": s["end_time"]
-                })
-        else:
-            # For English videos, use the original text
-            sentence_data = [
-                {
-                    "text": s["text"], 
-                    "start_time": s["start_time"], 
-                    "end_time": s["end_time"]
-                } 
-                for s in sentences
-            ]
+        # Extract just the text and timing info for processing.
+        # For translated (Hebrew/Arabic) videos each sentence already holds its own
+        # segment translation from transcribe_audio, so every sentence is classified once
+        # on its translated text in both modes.
+        sentence_data = [
+            {
+                "text": s["text"], 
+                "start_time": s["start_time"], 
+                "end_time": s["end_time"]
+            } 
+            for s in sentences
+        ]
         
         update_progress(req.url, req.user_id, "analyzing_advanced", 10, "Analyzing complex emotions...")
         
         # Perform advanced emotion analysis
-        advanced_results = analyze_advanced_emotions(sentence_data)
+        with stage_seconds.time(stage="classify_emotions"):
+            advanced_results = analyze_advanced_emotions(sentence_data)
         
         # Extract emotion timeline for visualization
-        emotion_timeline = create_emotion_timeline(advanced_results)
+        with stage_seconds.time(stage="emotion_timeline"):
+            emotion_timeline = create_emotion_timeline(advanced_results)
         
         # Summarize dominant emotions
-        emotion_summary = summarize_emotions(advanced_results)
+        with stage_seconds.time(stage="summarize_emotions"):
+            emotion_summary = summarize_emotions(advanced_results)
         
         # Save results
-        db.collection("advanced_analyses").document(doc_id).set({
-            "user_id": req.user_id,
-            "video_url": req.url,
-            "sentence_emotions": advanced_results,
-            "emotion_timeline": emotion_timeline,
-            "emotion_summary": emotion_summary,
-            "created_at": firestore.SERVER_TIMESTAMP
-        })
+        with stage_seconds.time(stage="persist_emotions"):
+            get_storage().put_document(
+                "advanced_analyses", doc_id, advanced_document(req.user_id, req.url, advanced_results, emotion_timeline, emotion_summary)
+            )
+        invalidate_document("advanced_analyses", doc_id)
         
         update_progress(req.url, req.user_id, "complete_advanced", 100, "Advanced emotion analysis complete!")
         
@@ -709,40 +2593,45 @@ async def analyze_advanced(req: AnalyzeRequest):
         }
     except Exception as e:
         update_progress(req.url, req.user_id, "error_advanced", 0, f"Error in advanced analysis: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
-# Add this endpoint to check advanced analysis progress
-@app.get("/progress/advanced/{video_url:path}")
-async def get_advanced_progress(video_url: str):
-    try:
-        from urllib.parse import unquote
-        decoded_url = unquote(video_url)
-        doc_id = generate_doc_id(decoded_url)
-        
-        # First check if analysis exists
-        advanced_ref = db.collection("advanced_analyses").document(doc_id).get()
-        if advanced_ref.exists:
-            return {"status": "complete", "progress": 100}
-        
-        # Check progress
-        doc_ref = db.collection("analysis_progress").document(doc_id).get()
-        
-        if doc_ref.exists:
-            progress_data = doc_ref.to_dict()
-            # Only return if it's advanced progress
-            if progress_data.get("status", "").startswith("analyzing_advanced") or progress_data.get("status", "").startswith("complete_advanced"):
-                return progress_data
-            
-        return {"status": "not_started", "progress": 0}
-    except Exception as e:
-        return {"status": "error", "progress": 0, "message": str(e)}
+        raise
 
+advanced_jobs = AnalysisJobQueue(
+    lambda job: run_advanced_analysis(job.req),
+    on_queued=lambda job: update_progress(job.req.url, job.req.user_id, "queued_advanced", 0, "Waiting for the emotion model...", job_id=job.id),
+    on_rejected=lambda job: update_progress(job.req.url, job.req.user_id, "error_advanced", 0, f"Error in advanced analysis: {job.error}", job_id=job.id),
+    workers=ADVANCED_ANALYSIS_WORKERS,
+)
 
-# Add this endpoint to get advanced results
-@app.get("/results/advanced/{video_url:path}")
-async def get_advanced_results(video_url: str):
-    doc_id = generate_doc_id(video_url)
-    doc_ref = db.collection("advanced_analyses").document(doc_id).get()
-    if doc_ref.exists:
-        return doc_ref.to_dict()
-    
-    raise HTTPException(status_code=404, detail="Advanced analysis not found")
\ No newline at end of file
+# Queues the analysis and returns 202 right away, like /analyze, so waiting requests do
+# not hold thread pool threads. Clients poll progress_url (/progress/advanced/...) and then
+# read /results/advanced/... Requests for the same video share one run.
+@app.post("/analyze/advanced-emotions")
+def analyze_advanced(req: AnalyzeRequest):
+    # First check if basic analysis exists. A partial ("transcribed") document has no
+    # sentences yet, analyzing it would store an empty advanced analysis for good.
+    doc_id = generate_doc_id(req.url)
+    basic_analysis = read_document("analyses", doc_id)
+    if basic_analysis is None:
+        raise HTTPException(status_code=404, detail="Basic analysis not found. Run basic analysis first.")
+    if basic_analysis.get("status", "complete") != "complete":
+        raise HTTPException(status_code=409, detail="Basic analysis is still running. Try again once it is complete.")
+
+    # Check if advanced analysis already exists
+    advanced = read_document("advanced_analyses", doc_id)
+    if advanced is not None:
+        advanced["emotion_timeline"] = format_timeline(advanced.get("emotion_timeline", []))
+        return advanced
+
+    try:
+        job, created = advanced_jobs.submit(req, key=doc_id)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return JSONResponse({
+        "job_id": job.id,
+        "user_id": req.user_id,
+        "video_url": req.url,
+        "status": job.status,
+        "attached": not created,
+        "progress_url": f"/progress/advanced/{quote(req.url, safe='')}",
+        "results_url": f"/results/advanced/{quote(req.url, safe='')}",
+    }, status_code=202)
@@ -0,0 +1,300 @@
+"""Benchmark the analysis pipeline on fixture and generated Whisper responses.
+
+Replays Whisper verbose_json responses through the same functions /analyze and
+/analyze/advanced-emotions use, and reports latency, throughput and peak memory per
+stage. Nothing is downloaded or sent to OpenAI/Firestore. By default the models are
+replaced by stubs (so the numbers measure our own code), --models local loads the
+real Hugging Face pipelines.
+
+The fixtures in benchmark_fixtures/ are synthetic as well: their text comes from the
+analyses in results/, their segment timings are made up (see each file's "source").
+
+    python benchmark.py                                  # fixtures + 10/60/180 minute videos
+    python benchmark.py --minutes 30,120 --json out.json
+    python benchmark.py --baseline out.json              # exit code 1 when a stage got slower
+    python benchmark.py --parity onnx-int8               # compare a MODEL_BACKEND with PyTorch
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+# No Firebase, no warm-up: the app is only used as a library here. The classification
+# cache is off so repeats measure inference (and stub outputs never reach the real cache).
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PRELOAD_MODELS", "")
+os.environ.setdefault("CLASSIFICATION_CACHE", "false")
+
+import app
+import classifiers
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_fixtures")
+
+STAGES = [
+    "extract_sentences",
+    "analyze_sentences",
+    "apply_smoothing",
+    "summarize_results",
+    "analyze_advanced_emotions",
+    "create_emotion_timeline",
+    "summarize_emotions",
+]
+
+GOEMOTIONS_LABELS = [
+    "admiration", "amusement", "anger", "annoyance", "approval", "caring", "confusion",
+    "curiosity", "desire", "disappointment", "disapproval", "disgust", "embarrassment",
+    "excitement", "fear", "gratitude", "grief", "joy", "love", "nervousness", "optimism",
+    "pride", "realization", "relief", "remorse", "sadness", "surprise", "neutral",
+]
+
+WORDS = (
+    "the video really great today we think this is not what people said about new "
+    "price bad love hate maybe never always team game show music news really very "
+    "good happy sad angry funny strange amazing terrible honest"
+).split()
+
+
+# ------ STUB MODELS -------
+
+# Same call signature and output shape as the transformers pipelines, scores derived from the text
+class StubSentiment:
+    def __call__(self, inputs, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        return [{"label": f"LABEL_{len(text) % 3}", "score": 0.9} for text in texts]
+
+
+class StubGoEmotions:
+    def __call__(self, inputs, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else inputs
+        outputs = []
+        for text in texts:
+            rng = random.Random(text)
+            scores = [rng.random() for _ in GOEMOTIONS_LABELS]
+            total = sum(scores)
+            outputs.append([{"label": label, "score": score / total * 4} for label, score in zip(GOEMOTIONS_LABELS, scores)])
+        return outputs
+
+
+def use_stub_models():
+    app.model_registry.register("sentiment", StubSentiment)
+    app.model_registry.register("goemotions", StubGoEmotions)
+
+
+# ------ FIXTURES -------
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            fixtures.append((os.path.splitext(os.path.basename(path))[0], json.load(f)))
+    return fixtures
+
+
+# A verbose_json response for a video of the given length, one segment every 2-6 seconds
+def synthetic_transcript(minutes, seed=0):
+    rng = random.Random(seed)
+    segments = []
+    start = 0.0
+    duration = minutes * 60
+    while start < duration:
+        end = min(duration, start + rng.uniform(2, 6))
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 25))).capitalize() + "."
+        segments.append({"id": len(segments), "start": round(start, 2), "end": round(end, 2), "text": " " + text})
+        start = end
+    return {
+        "task": "transcribe",
+        "language": "english",
+        "duration": duration,
+        "text": "".join(segment["text"] for segment in segments).strip(),
+        "segments": segments,
+    }
+
+
+# ------ RUNNER -------
+
+def measure(fn, *args):
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = fn(*args)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - before
+    return result, seconds, peak
+
+
+# Run every stage once, returns {stage: {"seconds", "items", "items_per_second", "peak_mb"}}
+def run_pipeline(whisper_response):
+    stages = {}
+
+    def record(stage, fn, *args, items):
+        result, seconds, peak = measure(fn, *args)
+        count = items(result)
+        stages[stage] = {
+            "seconds": round(seconds, 4),
+            "items": count,
+            "items_per_second": round(count / seconds, 1) if seconds > 0 else None,
+            "peak_mb": round(peak / 1024 / 1024, 2),
+        }
+        return result
+
+    sentences = record("extract_sentences", app.extract_sentences_with_timestamps, whisper_response, items=len)
+    results = record("analyze_sentences", app.analyze_sentences, sentences, items=len)
+    record("apply_smoothing", app.apply_smoothing, results, items=len)
+    record("summarize_results", app.summarize_results, results, items=lambda _: len(results))
+    advanced = record("analyze_advanced_emotions", app.analyze_advanced_emotions, results, items=len)
+    record("create_emotion_timeline", app.create_emotion_timeline, advanced, items=len)
+    record("summarize_emotions", app.summarize_emotions, advanced, items=lambda _: len(advanced))
+    return stages
+
+
+def run_benchmark(minutes, repeat=1, fixtures=True, seed=0):
+    cases = load_fixtures() if fixtures else []
+    cases += [(f"synthetic_{m:g}min", synthetic_transcript(m, seed)) for m in minutes]
+
+    tracemalloc.start()
+    report = []
+    for name, response in cases:
+        # Keep the fastest of the repeats, the others mostly measure noise
+        best = None
+        for _ in range(repeat):
+            stages = run_pipeline(response)
+            if best is None:
+                best = stages
+            else:
+                for stage, numbers in stages.items():
+                    if numbers["seconds"] < best[stage]["seconds"]:
+                        best[stage] = numbers
+        report.append({
+            "case": name,
+            "video_seconds": response.get("duration") or max((s["end"] for s in response["segments"]), default=0),
+            "segments": len(response["segments"]),
+            "total_seconds": round(sum(numbers["seconds"] for numbers in best.values()), 4),
+            "stages": best,
+        })
+    tracemalloc.stop()
+    return report
+
+
+# Stages slower than baseline * (1 + tolerance), small absolute differences are ignored
+def find_regressions(report, baseline, tolerance=0.25, min_seconds=0.005):
+    previous = {case["case"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in report:
+        old_case = previous.get(case["case"])
+        if old_case is None:
+            continue
+        for stage, numbers in case["stages"].items():
+            old = old_case["stages"].get(stage)
+            if old is None:
+                continue
+            limit = max(old["seconds"] * (1 + tolerance), old["seconds"] + min_seconds)
+            if numbers["seconds"] > limit:
+                regressions.append((case["case"], stage, old["seconds"], numbers["seconds"]))
+    return regressions
+
+
+# ------ ACCURACY PARITY -------
+
+def top_emotions(output, k=3):
+    return [item["label"] for item in sorted(output, key=lambda item: item["score"], reverse=True)[:k]]
+
+
+def classify_timed(name, backend, texts):
+    classifier = classifiers.build_pipeline(name, backend)
+    start = time.perf_counter()
+    outputs = classifiers.run_batched_inference(classifier, texts, model_name=name)
+    return outputs, (time.perf_counter() - start) / max(1, len(texts))
+
+
+# Compare a model backend with the PyTorch pipelines on the same sentences: sentiment label
+# (through label_map) and the top-3 GoEmotions labels, plus per-sentence latency
+def check_parity(texts, backend, reference="pytorch"):
+    expected, reference_latency = classify_timed("sentiment", reference, texts)
+    actual, latency = classify_timed("sentiment", backend, texts)
+    sentiment_agreement = sum(
+        app.label_map.get(a["label"], "Neutral") == app.label_map.get(b["label"], "Neutral")
+        for a, b in zip(expected, actual) if a is not None and b is not None
+    ) / max(1, len(texts))
+
+    expected_emotions, emotions_reference_latency = classify_timed("goemotions", reference, texts)
+    actual_emotions, emotions_latency = classify_timed("goemotions", backend, texts)
+    pairs = [(top_emotions(a), top_emotions(b)) for a, b in zip(expected_emotions, actual_emotions) if a is not None and b is not None]
+    return {
+        "backend": backend,
+        "sentences": len(texts),
+        "sentiment_agreement": round(sentiment_agreement, 4),
+        "top1_emotion_agreement": round(sum(a[0] == b[0] for a, b in pairs) / max(1, len(texts)), 4),
+        "top3_emotion_agreement": round(sum(set(a) == set(b) for a, b in pairs) / max(1, len(texts)), 4),
+        "sentiment_ms_per_sentence": {reference: round(reference_latency * 1000, 2), backend: round(latency * 1000, 2)},
+        "goemotions_ms_per_sentence": {reference: round(emotions_reference_latency * 1000, 2), backend: round(emotions_latency * 1000, 2)},
+    }
+
+
+def parity_texts(seed=0, minutes=10):
+    texts = [segment["text"].strip() for _, response in load_fixtures() for segment in response["segments"]]
+    texts += [segment["text"].strip() for segment in synthetic_transcript(minutes, seed)["segments"]]
+    return texts
+
+
+def print_report(report):
+    print(f"{'case':<24}{'stage':<28}{'items':>8}{'seconds':>10}{'items/s':>12}{'peak MB':>10}")
+    for case in report:
+        for stage in STAGES:
+            numbers = case["stages"][stage]
+            rate = numbers["items_per_second"] if numbers["items_per_second"] is not None else "-"
+            print(f"{case['case']:<24}{stage:<28}{numbers['items']:>8}{numbers['seconds']:>10.4f}{rate:>12}{numbers['peak_mb']:>10.2f}")
+        print(f"{case['case']:<24}{'total':<28}{case['segments']:>8}{case['total_seconds']:>10.4f}")
+        print()
+    # ru_maxrss is in KB on Linux
+    print(f"Process max RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sentiment and emotion analysis pipeline.")
+    parser.add_argument("--minutes", default="10,60,180", help="comma separated lengths of the synthetic videos")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest one is reported")
+    parser.add_argument("--models", choices=["stub", "local"], default="stub", help="stub models or the real Hugging Face pipelines")
+    parser.add_argument("--no-fixtures", "--no-recorded", dest="no_fixtures", action="store_true", help="skip the fixtures in benchmark_fixtures/")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="compare with a report written earlier with --json")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--parity", choices=[b for b in classifiers.MODEL_BACKENDS if b != "pytorch"], help="check a model backend against PyTorch instead of benchmarking")
+    parser.add_argument("--min-agreement", type=float, default=0.97, help="lowest accepted sentiment and top-3 emotion agreement")
+    args = parser.parse_args(argv)
+
+    if args.parity:
+        parity = check_parity(parity_texts(args.seed), args.parity)
+        print(json.dumps(parity, indent=2))
+        if min(parity["sentiment_agreement"], parity["top3_emotion_agreement"]) < args.min_agreement:
+            print(f"PARITY FAILED: agreement below {args.min_agreement}")
+            return 1
+        return 0
+
+    if args.models == "stub":
+        use_stub_models()
+    minutes = [float(m) for m in args.minutes.split(",") if m.strip()]
+    report = run_benchmark(minutes, repeat=args.repeat, fixtures=not args.no_fixtures, seed=args.seed)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"models": args.models, "cases": report}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for case, stage, old, new in regressions:
+            print(f"REGRESSION {case} {stage}: {old:.4f}s -> {new:.4f}s")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,313 @@
+from dotenv import load_dotenv
+import os
+import gc
+import json
+import time
+import shutil
+import tempfile
+import threading
+import urllib.request
+from collections import Counter
+from contextlib import contextmanager
+from monitoring import metrics
+
+# Classifier loading and batched inference, shared by the API (app.py) and the inference
+# server (inference_server.py), which must not import the API's storage, queues and caches
+
+load_dotenv()
+
+# ------ MODEL REGISTRY -------
+
+# Seconds a model may sit unused before it is unloaded (0 disables unloading)
+MODEL_IDLE_TIMEOUT = float(os.getenv("MODEL_IDLE_TIMEOUT", "600"))
+# Comma separated model names to load at startup instead of on first use
+PRELOAD_MODELS = [m.strip() for m in os.getenv("PRELOAD_MODELS", "sentiment").split(",") if m.strip()]
+
+class ModelRegistry:
+    """Loads each classifier once per process and shares it between requests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._specs = {}
+        self._models = {}
+        self._load_locks = {}
+        self._last_used = {}
+        self._in_use = Counter()
+        self._loading = set()
+        self._reaper = None
+
+    def register(self, name, loader, idle_timeout=None):
+        with self._lock:
+            self._specs[name] = {"loader": loader, "idle_timeout": idle_timeout}
+            self._load_locks[name] = threading.Lock()
+        if idle_timeout:
+            self._start_reaper()
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is None:
+            if name not in self._specs:
+                raise KeyError(f"Unknown model: {name}")
+            # Per-model lock so concurrent first requests load the weights only once
+            with self._load_locks[name]:
+                model = self._models.get(name)
+                if model is None:
+                    print(f"Loading model: {name}")
+                    self._loading.add(name)
+                    try:
+                        model = self._specs[name]["loader"]()
+                    finally:
+                        self._loading.discard(name)
+                    with self._lock:
+                        self._models[name] = model
+        self._last_used[name] = time.monotonic()
+        return model
+
+    @contextmanager
+    def use(self, name):
+        # Models that are in use are never unloaded by the idle reaper
+        with self._lock:
+            self._in_use[name] += 1
+        try:
+            yield self.get(name)
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                self._last_used[name] = time.monotonic()
+
+    def warm_up(self, names=None):
+        for name in (names if names is not None else PRELOAD_MODELS):
+            self.get(name)
+
+    def loaded(self):
+        return list(self._models)
+
+    # "warm", "loading" or "cold" for every registered model
+    def status(self):
+        return {
+            name: "warm" if name in self._models else "loading" if name in self._loading else "cold"
+            for name in self._specs
+        }
+
+    def unload_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        unloaded = []
+        with self._lock:
+            for name, model in list(self._models.items()):
+                idle_timeout = self._specs[name]["idle_timeout"]
+                if not idle_timeout or self._in_use[name] > 0:
+                    continue
+                if now - self._last_used.get(name, now) >= idle_timeout:
+                    del self._models[name]
+                    unloaded.append(name)
+        if unloaded:
+            gc.collect()
+            print(f"Unloaded idle models: {unloaded}")
+        return unloaded
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+        self._reaper.start()
+
+    def _reap_forever(self):
+        while True:
+            timeouts = [s["idle_timeout"] for s in self._specs.values() if s["idle_timeout"]]
+            time.sleep(max(1, min(timeouts) / 2) if timeouts else 30)
+            self.unload_idle()
+
+model_registry = ModelRegistry()
+
+# "pytorch" runs the Hugging Face models as they are, "onnx" exports them to ONNX Runtime
+# once (under CACHE_DIR/onnx) and "onnx-int8" also applies dynamic int8 quantization.
+# The ONNX backends need: pip install optimum[onnxruntime]
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "pytorch")
+MODEL_BACKENDS = ("pytorch", "onnx", "onnx-int8")
+# Threads per ONNX Runtime session. Each worker process runs its own session, so keep
+# workers x threads at or below the number of physical cores.
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", str(min(4, os.cpu_count() or 1))))
+# Directory for on-disk caches (ONNX exports here, media, translations and classifications
+# in app.py). Defaults to backend/cache, independent of the directory the server is started from.
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache"))
+ONNX_CACHE_DIR = os.path.join(CACHE_DIR, "onnx")
+
+MODEL_SPECS = {
+    "sentiment": {"task": "sentiment-analysis", "model": "cardiffnlp/twitter-roberta-base-sentiment", "kwargs": {}},
+    "goemotions": {
+        "task": "text-classification",
+        "model": "monologg/bert-base-cased-goemotions-original",
+        "kwargs": {"return_all_scores": True},
+    },
+}
+
+# Export the model to ONNX (and quantize it) on first use, later loads reuse the files
+def export_onnx_model(model_id, quantize=False):
+    from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from transformers import AutoTokenizer
+
+    export_dir = os.path.join(ONNX_CACHE_DIR, model_id.replace("/", "__"))
+    if not os.path.exists(os.path.join(export_dir, "model.onnx")):
+        print(f"Exporting {model_id} to ONNX")
+        # Export next to the target and rename, so other workers never see a half-written model
+        os.makedirs(os.path.dirname(export_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(export_dir))
+        ORTModelForSequenceClassification.from_pretrained(model_id, export=True).save_pretrained(tmp_dir)
+        AutoTokenizer.from_pretrained(model_id).save_pretrained(tmp_dir)
+        try:
+            os.replace(tmp_dir, export_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if not quantize:
+        return export_dir, "model.onnx"
+    if not os.path.exists(os.path.join(export_dir, "model_quantized.onnx")):
+        print(f"Quantizing {model_id} to int8")
+        quantizer = ORTQuantizer.from_pretrained(export_dir, file_name="model.onnx")
+        # Dynamic quantization: int8 weights, activations quantized at run time (no calibration data)
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(export_dir))
+        quantizer.quantize(save_dir=tmp_dir, quantization_config=config)
+        os.replace(os.path.join(tmp_dir, "model_quantized.onnx"), os.path.join(export_dir, "model_quantized.onnx"))
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return export_dir, "model_quantized.onnx"
+
+def load_onnx_pipeline(task, model_id, quantize=False, **kwargs):
+    try:
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise ImportError(f"MODEL_BACKEND={MODEL_BACKEND} needs optimum[onnxruntime]: {e}") from e
+    from transformers import AutoTokenizer, pipeline
+
+    export_dir, file_name = export_onnx_model(model_id, quantize)
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = 1
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    model = ORTModelForSequenceClassification.from_pretrained(
+        export_dir, file_name=file_name, session_options=options, provider="CPUExecutionProvider"
+    )
+    return pipeline(task, model=model, tokenizer=AutoTokenizer.from_pretrained(export_dir), **kwargs)
+
+# Build a registered model with the given backend. transformers takes seconds to import,
+# so it is only imported when the first model loads. The pipeline's backend attribute
+# tells the classification cache which backend produced its outputs.
+def build_pipeline(name, backend=None):
+    backend = backend or MODEL_BACKEND
+    spec = MODEL_SPECS[name]
+    if backend not in MODEL_BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend}")
+    if backend != "pytorch":
+        classifier = load_onnx_pipeline(spec["task"], spec["model"], quantize=backend == "onnx-int8", **spec["kwargs"])
+    else:
+        from transformers import pipeline
+        classifier = pipeline(spec["task"], model=spec["model"], **spec["kwargs"])
+    classifier.backend = backend
+    return classifier
+
+# ------ BATCHED INFERENCE -------
+
+# Batched inference settings (sentences per forward pass / max tokens per sentence)
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "32"))
+SENTIMENT_MAX_LENGTH = int(os.getenv("SENTIMENT_MAX_LENGTH", "128"))
+model_batch_size = metrics.histogram(
+    "arcscan_model_batch_size", "Sentences per classifier call",
+    [1, 2, 4, 8, 16, 32, 64, 128, 256],
+)
+
+# Run a text classifier over many texts in length-sorted batches (the pipeline pads each batch).
+# Returns one output per text in the original order (same shape as classifier(text)[0]),
+# or None for texts that failed even when retried on their own (remote classifiers raise instead).
+def run_batched_inference(classifier, texts, batch_size=SENTIMENT_BATCH_SIZE, max_length=SENTIMENT_MAX_LENGTH, model_name="sentiment", **kwargs):
+    outputs = [None] * len(texts)
+    # The inference server batches across jobs itself, so send it everything at once
+    if getattr(classifier, "batches_remotely", False):
+        batch_size = max(1, len(texts))
+    # Sorting by length keeps similar-sized sentences together so padding stays small
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    call_kwargs = {"truncation": True, "max_length": max_length, **kwargs}
+
+    for b in range(0, len(order), batch_size):
+        batch_idx = order[b:b + batch_size]
+        batch_texts = [texts[i] for i in batch_idx]
+        model_batch_size.observe(len(batch_texts), model=model_name)
+        try:
+            batch_out = classifier(batch_texts, batch_size=len(batch_texts), **call_kwargs)
+            for i, out in zip(batch_idx, batch_out):
+                outputs[i] = out
+        except Exception as e:
+            # A failed request to the inference server would fail again for every sentence
+            if getattr(classifier, "batches_remotely", False):
+                raise
+            # One bad input should not sink the whole batch, retry one by one
+            print(f"Batch inference failed, retrying per sentence: {e}")
+            for i in batch_idx:
+                try:
+                    outputs[i] = classifier(texts[i], **call_kwargs)[0]
+                except Exception:
+                    outputs[i] = None
+    return outputs
+
+# ------ INFERENCE SERVER CLIENT -------
+# API workers started with INFERENCE_SERVER_URL send their sentences to the shared
+# inference server (inference_server.py) instead of loading the models themselves
+
+INFERENCE_SERVER_URL = os.getenv("INFERENCE_SERVER_URL", "").rstrip("/")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "300"))
+INFERENCE_READY_TIMEOUT = float(os.getenv("INFERENCE_READY_TIMEOUT", "5"))
+
+# True in the inference server process, its models always load locally
+serving_inference = False
+
+# The inference server's /ready body once it has loaded its PRELOAD_MODELS, otherwise None
+def inference_server_status(url=None, timeout=INFERENCE_READY_TIMEOUT):
+    try:
+        with urllib.request.urlopen(f"{url or INFERENCE_SERVER_URL}/ready", timeout=timeout) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None
+
+class RemoteClassifier:
+    """Pipeline-compatible client for the shared inference server."""
+
+    batches_remotely = True
+
+    def __init__(self, model_name, url=None, timeout=INFERENCE_TIMEOUT, backend=None):
+        self.model_name = model_name
+        self.url = url or INFERENCE_SERVER_URL
+        self.timeout = timeout
+        # Backend the server runs the model with, updated from every response
+        self.backend = backend
+
+    # Truncation and other pipeline arguments are applied by the server
+    def __call__(self, inputs, **kwargs):
+        texts = [inputs] if isinstance(inputs, str) else list(inputs)
+        request = urllib.request.Request(
+            f"{self.url}/classify/{self.model_name}",
+            data=json.dumps({"texts": texts}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            body = json.loads(response.read())
+        self.backend = body.get("backend", self.backend)
+        return body["outputs"]
+
+# ------ MODELS -------
+
+# With INFERENCE_SERVER_URL set, API workers get a client for the shared inference server instead
+def load_model(name):
+    if INFERENCE_SERVER_URL and not serving_inference:
+        # The model stays cold (and loading is retried on next use) until the server is up
+        status = inference_server_status()
+        if status is None:
+            raise RuntimeError(f"Inference server at {INFERENCE_SERVER_URL} is not ready")
+        return RemoteClassifier(name, backend=status.get("backend"))
+    return build_pipeline(name)
+
+# Setup EmoRoBERTa (kept resident, it runs on every /analyze request)
+model_registry.register("sentiment", lambda: load_model("sentiment"))
+# GoEmotions is only needed for advanced analysis, so it is unloaded when idle (to save memory)
+model_registry.register("goemotions", lambda: load_model("goemotions"), idle_timeout=MODEL_IDLE_TIMEOUT)
@@ -0,0 +1,119 @@
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+import classifiers
+from classifiers import model_registry, run_batched_inference, PRELOAD_MODELS, MODEL_BACKEND, SENTIMENT_MAX_LENGTH
+from monitoring import metrics
+
+# ------ SHARED INFERENCE SERVER -------
+# One process per host holds the weights and classifies sentences for every API worker:
+#   uvicorn inference_server:inference_app --port 8100 --workers 1
+# and start the API workers with INFERENCE_SERVER_URL=http://127.0.0.1:8100
+# It only imports the model code, not the API's job queue, storage and caches.
+
+# Models in this process always load locally, even if INFERENCE_SERVER_URL is set
+classifiers.serving_inference = True
+
+# A batch runs once it has INFERENCE_MAX_BATCH sentences or its first sentence waited INFERENCE_MAX_WAIT_MS
+INFERENCE_MAX_BATCH = int(os.getenv("INFERENCE_MAX_BATCH", "64"))
+INFERENCE_MAX_WAIT_MS = float(os.getenv("INFERENCE_MAX_WAIT_MS", "10"))
+
+class MicroBatcher:
+    """Collects sentences from concurrent requests into shared forward passes."""
+
+    def __init__(self, model_name, max_batch=INFERENCE_MAX_BATCH, max_wait_ms=INFERENCE_MAX_WAIT_MS):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # One future per text, resolved with the classifier output (None if it failed)
+    def submit(self, texts):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"batcher-{self.model_name}", daemon=True)
+                self._thread.start()
+        futures = []
+        for text in texts:
+            future = Future()
+            self._pending.put((text, future))
+            futures.append(future)
+        return futures
+
+    def _next_batch(self):
+        items = [self._pending.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._next_batch()
+            texts = [text for text, _ in items]
+            try:
+                with model_registry.use(self.model_name) as classifier:
+                    outputs = run_batched_inference(
+                        classifier, texts, batch_size=self.max_batch, max_length=SENTIMENT_MAX_LENGTH, model_name=self.model_name
+                    )
+                for (_, future), output in zip(items, outputs):
+                    future.set_result(output)
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+
+batchers = {name: MicroBatcher(name) for name in ("sentiment", "goemotions")}
+
+@asynccontextmanager
+async def inference_lifespan(app):
+    threading.Thread(target=model_registry.warm_up, daemon=True).start()
+    yield
+
+inference_app = FastAPI(lifespan=inference_lifespan)
+
+class ClassifyRequest(BaseModel):
+    texts: list[str]
+
+@inference_app.post("/classify/{model_name}")
+async def classify(model_name: str, req: ClassifyRequest):
+    batcher = batchers.get(model_name)
+    if batcher is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model: {model_name}")
+    futures = batcher.submit(req.texts)
+    try:
+        outputs = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"outputs": outputs, "backend": MODEL_BACKEND}
+
+@inference_app.get("/ready")
+async def inference_ready():
+    models = model_registry.status()
+    is_ready = all(models.get(name) == "warm" for name in PRELOAD_MODELS)
+    return JSONResponse({"ready": is_ready, "models": models, "backend": MODEL_BACKEND}, status_code=200 if is_ready else 503)
+
+# Which models are loaded, read from the registry on every scrape
+@metrics.collector
+def collect_model_metrics():
+    return [
+        ("arcscan_model_loaded", "gauge", "1 when the model is loaded in this process",
+         [({"model": name}, int(state == "warm")) for name, state in model_registry.status().items()]),
+    ]
+
+# Prometheus scrape endpoint
+@inference_app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
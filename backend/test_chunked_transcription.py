@@ -0,0 +1,119 @@
+"""Chunked transcription against a fake backend.
+
+plan_audio_chunks cuts long audio into overlapping chunks and merge_chunk_transcripts
+shifts every chunk's segments back to video time, keeping each segment once. The fake
+backend below plays Whisper on a known transcript: it returns the segments heard inside
+a chunk, with times relative to the chunk start, so segments in the overlaps come back
+twice and the merge has to drop the copies.
+
+    cd backend && python -m pytest -q test_chunked_transcription.py
+"""
+import io
+import os
+import random
+
+import pytest
+
+# No Firebase and no models are needed, the app is only used as a library here
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PRELOAD_MODELS", "")
+
+import app
+
+# Segments of a known transcript, with the silences between them
+def random_transcript(rng, duration):
+    segments, silences = [], []
+    t = 0.0
+    while True:
+        length = rng.choice([0.8, 2, 3.5, 6, 11])
+        if t + length > duration:
+            break
+        segments.append({"start": t, "end": t + length, "text": f" words {len(segments)}"})
+        gap = rng.choice([0, 0, 0.3, 0.6, 1.5, 4])
+        if gap >= 0.4:
+            silences.append((t + length, t + length + gap))
+        t += length + gap
+    return segments, silences
+
+# What Whisper would return for the audio between start and end
+def fake_response(segments, start, end):
+    return {
+        "task": "transcribe",
+        "language": "english",
+        "duration": end - start,
+        "segments": [
+            {"id": i, "start": s["start"] - start, "end": s["end"] - start, "text": s["text"]}
+            for i, s in enumerate(s for s in segments if start <= (s["start"] + s["end"]) / 2 <= end)
+        ],
+    }
+
+def assert_same_segments(merged, segments):
+    assert [s["text"] for s in merged["segments"]] == [s["text"] for s in segments]
+    assert [s["id"] for s in merged["segments"]] == list(range(len(segments)))
+    for actual, expected in zip(merged["segments"], segments):
+        assert actual["start"] == pytest.approx(expected["start"])
+        assert actual["end"] == pytest.approx(expected["end"])
+
+@pytest.mark.parametrize("seed", range(100))
+@pytest.mark.parametrize("chunk_seconds", [60, 600])
+def test_merge_keeps_every_segment_once_in_video_time(seed, chunk_seconds):
+    rng = random.Random(seed)
+    duration = rng.uniform(chunk_seconds * 1.5, chunk_seconds * 6)
+    segments, silences = random_transcript(rng, duration)
+
+    chunks = app.plan_audio_chunks(duration, silences, chunk_seconds, overlap=2)
+    assert len(chunks) > 1
+    assert chunks[0]["own_start"] == 0 and chunks[-1]["own_end"] == duration
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous["own_end"] == chunk["own_start"]
+        assert chunk["start"] == chunk["own_start"] - 2
+
+    merged = app.merge_chunk_transcripts(chunks, [fake_response(segments, c["start"], c["end"]) for c in chunks])
+    assert_same_segments(merged, segments)
+    assert merged["text"] == " ".join(s["text"].strip() for s in segments)
+    assert merged["language"] == "english"
+    assert merged["duration"] == duration
+
+def test_cuts_land_in_silences():
+    segments = [{"start": t, "end": t + 9, "text": f" {t}"} for t in range(0, 300, 10)]
+    silences = [(t + 9, t + 10) for t in range(0, 300, 10)]
+    chunks = app.plan_audio_chunks(300, silences, chunk_seconds=100, overlap=2)
+    assert [c["own_start"] for c in chunks] == [0, 99.5, 199.5]
+
+    merged = app.merge_chunk_transcripts(chunks, [fake_response(segments, c["start"], c["end"]) for c in chunks])
+    assert_same_segments(merged, segments)
+
+# The full pipeline with ffmpeg replaced: a "file" holds the transcript's time range and
+# every extracted chunk is a file holding its own range
+def test_transcribe_in_chunks_with_fake_backend(tmp_path, monkeypatch):
+    rng = random.Random(7)
+    duration = 1900.0
+    segments, silences = random_transcript(rng, duration)
+    source = tmp_path / "audio.ogg"
+    source.write_text(f"0 {duration}")
+
+    def extract(path, start, end, output_dir):
+        chunk_path = os.path.join(output_dir, f"chunk_{start:.2f}.ogg")
+        with open(chunk_path, "w") as f:
+            f.write(f"{start} {end}")
+        return chunk_path
+
+    def backend(audio_file):
+        start, end = map(float, audio_file.read().split())
+        return fake_response(segments, start, end)
+
+    monkeypatch.setattr(app, "probe_audio_duration", lambda path: duration)
+    monkeypatch.setattr(app, "detect_silences", lambda path: silences)
+    monkeypatch.setattr(app, "extract_audio_chunk", extract)
+
+    merged = app.transcribe_in_chunks(str(source), backend, chunk_seconds=300, concurrency=3)
+    assert_same_segments(merged, segments)
+
+def test_short_audio_is_sent_whole():
+    calls = []
+    def backend(audio_file):
+        calls.append(audio_file.name)
+        return {"text": "hello", "segments": []}
+
+    assert app.transcribe_in_chunks(io.BytesIO(b"audio"), backend) == {"text": "hello", "segments": []}
+    assert calls == ["audio.ogg"]
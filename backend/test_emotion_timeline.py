@@ -0,0 +1,96 @@
+"""Regression test: the emotion timeline matches the original per-second loop.
+
+create_emotion_timeline builds a NumPy difference array instead of adding every score
+to every second of its sentence. The original implementation is kept below and both
+are run on random advanced results (gaps, overlaps, fractional times, segments that end
+before they start and emotions outside CORE_EMOTIONS).
+
+    cd backend && python -m pytest -q test_emotion_timeline.py
+"""
+import os
+import random
+
+import pytest
+
+# No Firebase and no models are needed, the app is only used as a library here
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PRELOAD_MODELS", "")
+
+import app
+
+EMOTIONS = app.CORE_EMOTIONS[:8] + ["remorse", "embarrassment"]
+
+# Original implementation
+def reference_emotion_timeline(results, window_size=5):
+    detected_emotions = set()
+    for result in results:
+        for emotion_data in result["emotions"]:
+            detected_emotions.add(emotion_data["emotion"])
+    tracked_emotions = list(detected_emotions.union(set(app.CORE_EMOTIONS)))
+
+    if not results:
+        return []
+    total_duration = max(r["end_time"] for r in results)
+    timeline = [{"time": t, **{emotion: 0 for emotion in tracked_emotions}} for t in range(int(total_duration) + 1)]
+
+    for result in results:
+        start = int(result["start_time"])
+        end = int(result["end_time"])
+        for emotion_data in result["emotions"]:
+            score = emotion_data["score"] / 100
+            for t in range(start, end + 1):
+                if t < len(timeline):
+                    timeline[t][emotion_data["emotion"]] += score
+
+    smoothed_timeline = []
+    for i in range(len(timeline)):
+        window = timeline[max(0, i - window_size // 2):min(len(timeline), i + window_size // 2 + 1)]
+        smoothed_point = {"time": timeline[i]["time"]}
+        for emotion in tracked_emotions:
+            smoothed_point[emotion] = sum(point[emotion] for point in window) / len(window)
+        smoothed_timeline.append(smoothed_point)
+    return smoothed_timeline
+
+def random_results(rng):
+    results = []
+    t = rng.choice([0, 0.5, 3])
+    for _ in range(rng.randint(1, 40)):
+        start = max(0, t + rng.choice([-3, 0, 0, 1, 4, 0.6, 2.2]))
+        # Negative lengths happen in stored results (end before start), they cover nothing
+        end = start + rng.choice([-3, -0.5, 0, 0.4, 1, 2, 5, 9])
+        results.append({
+            "text": "some sentence here",
+            "start_time": start,
+            "end_time": max(0, end),
+            "emotions": [
+                {"emotion": emotion, "score": round(rng.uniform(10, 100), 1)}
+                for emotion in rng.sample(EMOTIONS, rng.randint(0, 3))
+            ],
+        })
+        t = max(t, end)
+    return results
+
+def assert_same_timeline(actual, expected):
+    assert len(actual) == len(expected)
+    for row, expected_row in zip(actual, expected):
+        assert row.keys() == expected_row.keys()
+        # float32 matrix rounded to 6 digits against float64 sums
+        assert row == pytest.approx(expected_row, abs=1e-5)
+
+@pytest.mark.parametrize("seed", range(300))
+@pytest.mark.parametrize("window_size", [1, 3, 5, 8])
+def test_create_emotion_timeline_matches_reference(seed, window_size):
+    results = random_results(random.Random(seed))
+    assert_same_timeline(app.create_emotion_timeline(results, window_size), reference_emotion_timeline(results, window_size))
+
+def test_segment_ending_before_it_starts_adds_nothing():
+    results = [
+        {"text": "a", "start_time": 5, "end_time": 2, "emotions": [{"emotion": "joy", "score": 50}]},
+        {"text": "b", "start_time": 6, "end_time": 8, "emotions": [{"emotion": "joy", "score": 50}]},
+    ]
+    timeline = app.create_emotion_timeline(results)
+    assert min(row["joy"] for row in timeline) >= 0
+    assert_same_timeline(timeline, reference_emotion_timeline(results))
+
+def test_no_results():
+    assert app.create_emotion_timeline([]) == reference_emotion_timeline([])
@@ -0,0 +1,89 @@
+"""Regression test: the sentiment timeline matches the original per-second scan.
+
+assign_sentences_to_seconds and apply_smoothing replaced a scan over every sentence
+for every second. The original implementation is kept below and both are run on
+random transcripts (gaps, overlaps, ties, unsorted and zero-length sentences).
+
+    cd backend && python -m pytest -q test_timeline.py
+"""
+import os
+import random
+
+import pytest
+
+# No Firebase and no models are needed, the app is only used as a library here
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("PRELOAD_MODELS", "")
+
+import app
+
+SENTIMENTS = ["Positive", "Negative", "Neutral"]
+
+# Original implementation: the first sentence (in list order) containing t, otherwise the
+# first one nearest to t
+def reference_assign(sentence_results):
+    assigned = []
+    total_duration = max(s["end_time"] for s in sentence_results)
+    for t in range(int(total_duration) + 1):
+        current = None
+        for i, s in enumerate(sentence_results):
+            if s["start_time"] <= t and s["end_time"] >= t:
+                current = i
+                break
+        if current is None:
+            current = min(
+                range(len(sentence_results)),
+                key=lambda i: min(abs(t - sentence_results[i]["start_time"]), abs(t - sentence_results[i]["end_time"])),
+            )
+        assigned.append(current)
+    return assigned
+
+def reference_smoothing(sentence_results, window_size=3):
+    timeline_data = []
+    for t, i in enumerate(reference_assign(sentence_results)):
+        sentiment = sentence_results[i]["final_sentiment"]
+        timeline_data.append({"time": t, **{name: 1 if sentiment == name else 0 for name in SENTIMENTS}})
+
+    smoothed_data = []
+    for i, point in enumerate(timeline_data):
+        window = timeline_data[max(0, i - window_size // 2):min(len(timeline_data), i + window_size // 2 + 1)]
+        smoothed_data.append({
+            "time": point["time"],
+            **{name: sum(p[name] for p in window) / len(window) for name in SENTIMENTS},
+        })
+    return smoothed_data
+
+def random_sentences(rng):
+    sentences = []
+    t = rng.choice([0, 0.5, 3])
+    for index in range(rng.randint(1, 60)):
+        # Integer times make ties and touching sentences common, fractions test rounding
+        start = t + rng.choice([-4, -1, 0, 0, 1, 2, 7, 0.3, 2.7])
+        start = max(0, start)
+        end = start + rng.choice([0, 0.4, 1, 2, 3, 5, 12])
+        sentences.append({
+            "index": index,
+            "text": f"sentence {index}",
+            "final_sentiment": rng.choice(SENTIMENTS),
+            "start_time": start,
+            "end_time": end,
+        })
+        t = max(t, end) if rng.random() < 0.8 else start
+    if rng.random() < 0.3:
+        rng.shuffle(sentences)
+    return sentences
+
+@pytest.mark.parametrize("seed", range(300))
+def test_assign_sentences_to_seconds_matches_reference(seed):
+    sentences = random_sentences(random.Random(seed))
+    assert app.assign_sentences_to_seconds(sentences) == reference_assign(sentences)
+
+@pytest.mark.parametrize("seed", range(300))
+@pytest.mark.parametrize("window_size", [1, 3, 4, 7])
+def test_apply_smoothing_matches_reference(seed, window_size):
+    sentences = random_sentences(random.Random(seed))
+    assert app.apply_smoothing(sentences, window_size) == reference_smoothing(sentences, window_size)
+
+def test_single_sentence():
+    sentences = [{"index": 0, "text": "x", "final_sentiment": "Positive", "start_time": 2.5, "end_time": 4}]
+    assert app.apply_smoothing(sentences) == reference_smoothing(sentences)